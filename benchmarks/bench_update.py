@@ -0,0 +1,260 @@
+"""
+Offline benchmark of the update of one or many repos.
+
+A local stand-in pad server (`tests/padserver.py`) serves N synthetic pads (configurable size,
+latency, change rate and error rate). For every scenario (number of sources x number of repos)
+a fresh config and data directory is created and the repos are updated several times (the first
+round downloads everything, further rounds change a fraction of the pads). Every scenario runs in
+its own process, i.e. the peak RSS is measured per scenario.
+
+Usage (from the project root):
+
+    python benchmarks/bench_update.py --sources 10,1000 --repos 1,100
+    python benchmarks/bench_update.py --compare benchmarks/results/<older-result>.json
+
+The results are stored in `benchmarks/results/` (one JSON file per invocation).
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import logging
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BENCHMARK_DIR)
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+# allow running this script without installing the package (and importing the tests-package)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "src"))
+sys.path.insert(0, PROJECT_ROOT)
+
+import webtogit  # noqa: E402
+from webtogit import core  # noqa: E402
+from tests.padserver import PadServer, make_synthetic_pads  # noqa: E402
+
+
+def run_scenario(
+    number_of_sources: int,
+    number_of_repos: int,
+    size: int,
+    latency: float,
+    change_rate: float,
+    error_rate: float,
+    rounds: int,
+    jobs: int,
+) -> dict:
+    """
+    Run one scenario in the current process.
+
+    :return:    dict with the measured values (one entry per round)
+    """
+
+    # the reports would distort the measurement
+    logging.disable(logging.CRITICAL)
+
+    pads = make_synthetic_pads(number_of_sources, size)
+    padnames = sorted(pads)
+
+    with tempfile.TemporaryDirectory(prefix=f"{core.APPNAME}-bench-") as workdir:
+        configfile_path = os.path.join(workdir, "config", "settings.yml")
+        datadir_path = os.path.join(workdir, "data")
+        core.bootstrap_config(configfile_path, datadir_path)
+
+        with PadServer(pads, delay=latency, error_rate=error_rate, seed=0) as server:
+            c = core.Core(configfile_path, datadir_path, jobs=jobs)
+
+            # the stand-in server does not need polite retries
+            c.retry_backoff = 0.01
+
+            repo_paths = []
+            for idx in range(number_of_repos):
+                c.init_archive_repo(f"repo{idx:03d}")
+                repo_path = os.path.join(c.datadir_path, f"repo{idx:03d}")
+                urls = [server.url(name) for name in padnames[idx::number_of_repos]]
+                with open(os.path.join(repo_path, f"{core.APPNAME}-sources.yml"), "w") as txtfile:
+                    txtfile.write("\n".join(f"- {url}" for url in urls) + "\n")
+                repo_paths.append(repo_path)
+
+            round_results = []
+            for round_idx in range(rounds):
+                changed_pads = server.change_pads(change_rate) if round_idx > 0 else padnames
+                c.metrics.reset()
+                c.failed_sources.clear()
+                number_of_requests = len(server.request_log)
+
+                start = time.perf_counter()
+                if number_of_repos == 1:
+                    changed_files = c.handle_repo(repo_paths[0], print_flag=False)
+                else:
+                    res = c.handle_all_repos(print_flag=False)
+                    changed_files = [path for paths in res.values() for path in paths]
+                wall_time = time.perf_counter() - start
+
+                phases = c.metrics.phases
+                failed = sum(len(failures) for failures in c.failed_sources.values())
+                round_results.append(
+                    {
+                        "wall_time": wall_time,
+                        "sources_per_second": number_of_sources / wall_time,
+                        "git_time": sum(
+                            value for key, value in phases.items() if key.startswith("git_")
+                        ),
+                        "phases": dict(phases),
+                        "requests": len(server.request_log) - number_of_requests,
+                        "changed_pads": len(changed_pads),
+                        "changed_files": len(changed_files),
+                        "failed_sources": failed,
+                    }
+                )
+
+    return {
+        "sources": number_of_sources,
+        "repos": number_of_repos,
+        "rounds": round_results,
+        # KiB on Linux
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_scenario_in_subprocess(number_of_sources: int, number_of_repos: int, args) -> dict:
+    cmd = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--single-scenario",
+        f"{number_of_sources},{number_of_repos}",
+        "--size",
+        str(args.size),
+        "--latency",
+        str(args.latency),
+        "--change-rate",
+        str(args.change_rate),
+        "--error-rate",
+        str(args.error_rate),
+        "--rounds",
+        str(args.rounds),
+        "--jobs",
+        str(args.jobs),
+    ]
+    res = subprocess.run(cmd, capture_output=True, check=True)
+
+    # the result is the last line of stdout
+    return json.loads(res.stdout.decode("utf8").strip().splitlines()[-1])
+
+
+def get_git_revision() -> str:
+    try:
+        res = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True
+        )
+    except FileNotFoundError:
+        return None
+    return res.stdout.decode("utf8").strip() or None
+
+
+def print_scenario(result: dict):
+    for idx, round_result in enumerate(result["rounds"]):
+        print(
+            f"  sources: {result['sources']:6d}  repos: {result['repos']:4d}  round {idx}: "
+            f"{round_result['wall_time']:8.2f} s  "
+            f"{round_result['sources_per_second']:8.1f} sources/s  "
+            f"git: {round_result['git_time']:7.2f} s  "
+            f"changed: {round_result['changed_files']:6d}  "
+            f"failed: {round_result['failed_sources']:4d}"
+        )
+    print(f"  peak RSS: {result['peak_rss_kib'] / 1024:.1f} MiB")
+
+
+def compare_results(old_path: str, new: dict):
+    """
+    Print the ratio of the throughput (sources/s) of every scenario which is present in both.
+    """
+    with open(old_path) as jsonfile:
+        old = json.load(jsonfile)
+
+    old_scenarios = {(res["sources"], res["repos"]): res for res in old["scenarios"]}
+    print(f"\ncomparison with {old_path} (version {old['version']}, {old['git_revision']}):")
+    for res in new["scenarios"]:
+        old_res = old_scenarios.get((res["sources"], res["repos"]))
+        if old_res is None:
+            continue
+        for idx, (old_round, new_round) in enumerate(zip(old_res["rounds"], res["rounds"])):
+            ratio = new_round["sources_per_second"] / old_round["sources_per_second"]
+            print(
+                f"  sources: {res['sources']:6d}  repos: {res['repos']:4d}  round {idx}: "
+                f"throughput x {ratio:.2f}  "
+                f"peak RSS x {res['peak_rss_kib'] / old_res['peak_rss_kib']:.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sources", default="10,1000,10000", help="comma separated scales")
+    parser.add_argument("--repos", default="1,100", help="comma separated numbers of repos")
+    parser.add_argument("--size", type=int, default=2048, help="size of a pad (bytes)")
+    parser.add_argument("--latency", type=float, default=0.01, help="latency of the server (s)")
+    parser.add_argument("--change-rate", type=float, default=0.1, help="per round")
+    parser.add_argument("--error-rate", type=float, default=0, help="probability of a 503")
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--jobs", type=int, default=core.DEFAULT_JOBS)
+    parser.add_argument("--output", help="path of the result file (default: results dir)")
+    parser.add_argument("--compare", metavar="RESULT_FILE", help="compare with older results")
+    parser.add_argument("--single-scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single_scenario:
+        number_of_sources, number_of_repos = map(int, args.single_scenario.split(","))
+        result = run_scenario(
+            number_of_sources,
+            number_of_repos,
+            args.size,
+            args.latency,
+            args.change_rate,
+            args.error_rate,
+            args.rounds,
+            args.jobs,
+        )
+        print(json.dumps(result))
+        return
+
+    results = {
+        "version": webtogit.__version__,
+        "git_revision": get_git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parameters": {
+            key: getattr(args, key)
+            for key in ("size", "latency", "change_rate", "error_rate", "rounds", "jobs")
+        },
+        "scenarios": [],
+    }
+
+    for number_of_sources in map(int, args.sources.split(",")):
+        for number_of_repos in map(int, args.repos.split(",")):
+            if number_of_repos > number_of_sources:
+                continue
+            result = run_scenario_in_subprocess(number_of_sources, number_of_repos, args)
+            print_scenario(result)
+            results["scenarios"].append(result)
+
+    output_path = args.output
+    if output_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        fname = f"{results['timestamp']}-{results['version']}-{results['git_revision']}.json"
+        output_path = os.path.join(RESULTS_DIR, fname.replace(":", "-"))
+    with open(output_path, "w") as jsonfile:
+        json.dump(results, jsonfile, indent=1)
+    print(f"\nresults written to {output_path}")
+
+    if args.compare:
+        compare_results(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Source adapters: knowledge about specific pad software. An adapter can provide a cheap "probe"
+request which returns the current revision of a document. If the revision did not change since
+the last download, the (possibly large) body is not downloaded at all.
+
+The adapter of a source is selected by the key `type` of the source or by its url.
+"""
+
+import json
+import re
+from urllib.parse import urlencode, urlparse, unquote
+
+
+class HttpAdapter:
+    """
+    Default adapter: plain download of the url (no probe)
+    """
+
+    name = "http"
+
+    # urls which are handled by this adapter if the source has no key `type`
+    url_regex = None
+
+    # True if the adapter can archive incremental changes (source key `mode: changesets`)
+    supports_changesets = False
+
+    def __init__(self, config: dict = None):
+        """
+        :param config:  global settings (e.g. for API keys)
+        """
+        self.config = config or {}
+
+    def get_probe_url(self, url: str) -> str:
+        """
+        :return:    url of the probe request or None (no probe possible)
+
+        Adapters which return a probe url also implement `parse_probe_response(content)` which
+        returns the revision of the document (any string which changes with the content).
+        """
+        return None
+
+
+class EtherpadAdapter(HttpAdapter):
+    """
+    Etherpad: the revision count is available via the HTTP API (needs the API key of the
+    instance, see setting `etherpad_api_keys`). Without API key the source is just downloaded.
+    """
+
+    name = "etherpad"
+    url_regex = re.compile(r"^https?://.+/p/[^/?#]+/export/\w+/?$")
+    supports_changesets = True
+
+    # base url (might contain a path prefix) and pad id
+    pad_url_regex = re.compile(r"^(?P<base>https?://.+?)/p/(?P<pad>[^/?#]+)")
+
+    def get_api_url(self, url: str, method: str, api_version: str = "1", **params) -> str:
+        """
+        :return:    url of a call of the HTTP API for the pad or None (no api key)
+        """
+        match = self.pad_url_regex.match(url)
+        api_key = (self.config.get("etherpad_api_keys") or {}).get(urlparse(url).netloc)
+        if match is None or not api_key:
+            return None
+
+        params = {"padID": unquote(match.group("pad")), **params, "apikey": api_key}
+        return f"{match.group('base')}/api/{api_version}/{method}?{urlencode(params)}"
+
+    @staticmethod
+    def parse_api_response(content: bytes):
+        """
+        :return:    the `data` of the response of an api call
+        """
+        data = json.loads(content)
+        if data.get("code") != 0:
+            raise ValueError(f"etherpad api error: {data.get('message')}")
+        return data["data"]
+
+    def get_probe_url(self, url: str) -> str:
+        return self.get_api_url(url, "getRevisionsCount")
+
+    def parse_probe_response(self, content: bytes) -> str:
+        return str(self.parse_api_response(content)["revisions"])
+
+    def get_text_url(self, url: str, revision: int) -> str:
+        return self.get_api_url(url, "getText", rev=revision)
+
+    def parse_text_response(self, content: bytes) -> str:
+        return self.parse_api_response(content)["text"]
+
+    def get_changeset_url(self, url: str, revision: int) -> str:
+        # `getRevisionChangeset` is available since version 1.2.8 of the api
+        return self.get_api_url(url, "getRevisionChangeset", api_version="1.2.8", rev=revision)
+
+    def parse_changeset_response(self, content: bytes) -> str:
+        return self.parse_api_response(content)
+
+
+class HedgedocAdapter(HttpAdapter):
+    """
+    HedgeDoc (and CodiMD): the metadata of a note (including the time of the last change) is
+    available at `<note-url>/info`.
+    """
+
+    name = "hedgedoc"
+    url_regex = re.compile(r"^https?://[^/]+(/.*)?/[^/?#]+/download/?$")
+
+    # note url (i.e. without the suffix `/download`)
+    note_url_regex = re.compile(r"^(?P<note_url>https?://[^?#]+?)(/download)?/?(\?.*)?$")
+
+    def get_probe_url(self, url: str) -> str:
+        match = self.note_url_regex.match(url)
+        if match is None:
+            return None
+        return f"{match.group('note_url')}/info"
+
+    def parse_probe_response(self, content: bytes) -> str:
+        # the view count (also part of the info) changes without changes of the content
+        data = json.loads(content)
+        return str(data["updatetime"])
+
+
+# one operation of a changeset: attributes, number of newlines, opcode, number of characters
+CHANGESET_OP_REGEX = re.compile(r"((?:\*[0-9a-z]+)*)(?:\|([0-9a-z]+))?([-+=])([0-9a-z]+)|(.)")
+
+
+def apply_changeset(text: str, changeset: str) -> str:
+    """
+    Apply an etherpad changeset (like `Z:8>3|1=4*0+3$abc`) to the text.
+
+    Etherpad (javascript) counts the lengths in UTF-16 code units. Thus, the text is handled as
+    UTF-16 (two bytes per unit) to get the same positions for characters outside of the BMP.
+    """
+
+    match = re.match(r"^Z:([0-9a-z]+)([><])([0-9a-z]+)", changeset)
+    if match is None or "$" not in changeset:
+        raise ValueError(f"invalid changeset: {changeset[:50]!r}")
+
+    old_len = int(match.group(1), 36)
+    diff = int(match.group(3), 36)
+    new_len = old_len + diff if match.group(2) == ">" else old_len - diff
+    ops, char_bank = changeset[match.end() :].split("$", 1)
+
+    old = text.encode("utf-16-le", errors="surrogatepass")
+    bank = char_bank.encode("utf-16-le", errors="surrogatepass")
+    if len(old) != 2 * old_len:
+        raise ValueError(f"changeset does not match the length of the text ({old_len})")
+
+    parts = []
+    pos = bank_pos = 0
+    for op_match in CHANGESET_OP_REGEX.finditer(ops):
+        if op_match.group(5) is not None:
+            raise ValueError(f"invalid operation in changeset: {op_match.group(5)!r}")
+        opcode, size = op_match.group(3), 2 * int(op_match.group(4), 36)
+        if opcode == "=":
+            parts.append(old[pos : pos + size])
+            pos += size
+        elif opcode == "-":
+            pos += size
+        else:
+            parts.append(bank[bank_pos : bank_pos + size])
+            bank_pos += size
+
+    # the rest of the text is kept implicitly
+    parts.append(old[pos:])
+    new = b"".join(parts)
+    if pos > len(old) or bank_pos > len(bank) or len(new) != 2 * new_len:
+        raise ValueError("changeset does not match the text")
+
+    return new.decode("utf-16-le", errors="surrogatepass")
+
+
+ADAPTERS = {cls.name: cls for cls in (HttpAdapter, EtherpadAdapter, HedgedocAdapter)}
+
+
+def create_adapters(config: dict) -> dict:
+    return {name: cls(config) for name, cls in ADAPTERS.items()}
+
+
+def select_adapter(sdict: dict, adapters: dict) -> HttpAdapter:
+    """
+    Return the adapter of the source: explicitly given by the key `type` or selected by the url.
+    """
+
+    type_ = sdict.get("type")
+    if type_ is not None:
+        if type_ not in adapters:
+            msg = f"unknown type of source {sdict['url']}: {type_} (possible: {tuple(adapters)})"
+            raise ValueError(msg)
+        return adapters[type_]
+
+    for adapter in adapters.values():
+        if adapter.url_regex is not None and adapter.url_regex.match(sdict["url"]):
+            return adapter
+
+    return adapters[HttpAdapter.name]
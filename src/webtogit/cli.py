@@ -4,11 +4,7 @@ Command line interface for webtogit package
 
 import argparse
 import logging
-from ipydex import IPS, activate_ips_on_exception, TracerFactory
-from . import core, util as u
-
-activate_ips_on_exception()
-ST = TracerFactory()
+from . import core, daemon, util as u
 
 
 def main():
@@ -56,9 +52,102 @@ def main():
         help=f"Update all repositories",
         action="store_true",
     )
+    parser.add_argument(
+        "--daemon",
+        help=f"Run continuously and fetch every source according to its `interval`.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--rescan-repos",
+        help=f"Scan the data directory for repos and rebuild the repo registry. Then exit.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--migrate-layout",
+        help=(
+            f"Move the files of the repo (positional argument `reponame`) to a new content layout "
+            f"(one commit). Then exit."
+        ),
+        choices=core.CONTENT_LAYOUTS,
+        metavar="LAYOUT",
+    )
+    parser.add_argument(
+        "--maintenance",
+        help=f"Repack and garbage-collect all repositories (and report the saved space).",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        help=f"Number of sources which are downloaded concurrently (overrides settings.yml).",
+        type=int,
+        metavar="N",
+    )
+    parser.add_argument(
+        "--parallel-repos",
+        help=f"Number of repos which are processed in parallel processes (--update-all-repos).",
+        type=int,
+        metavar="N",
+    )
+
+    parser.add_argument(
+        "--full-rescan",
+        help=f"Stage and compare the whole content directory (not only the files written).",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--metrics-json",
+        help=f"Write timing metrics of the run as JSON to this file.",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        help=f"Write timing metrics of the run to this file (Prometheus textfile collector).",
+        metavar="PATH",
+    )
+
+    parser.add_argument(
+        "--profile",
+        help=f"Run the command under cProfile and tracemalloc. Write a pstats file and an "
+        "allocation report (per phase) and print the peak memory.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        help=f"Directory for the files of --profile (default: current working directory).",
+        metavar="DIR",
+    )
+
+    parser.add_argument(
+        "--debug",
+        help=f"Start an interactive IPython shell if an uncaught exception occurs (needs ipydex).",
+        action="store_true",
+    )
 
     args = parser.parse_args()
 
+    if args.debug:
+        # imported only on demand because importing ipydex (and IPython) takes long
+        from ipydex import activate_ips_on_exception
+
+        activate_ips_on_exception()
+
+    if args.profile:
+        # imported only on demand (cProfile and tracemalloc are not needed otherwise)
+        from .profiling import Profiler
+
+        with Profiler(output_dir=args.profile_dir):
+            run_command(args)
+    else:
+        run_command(args)
+
+
+def run_command(args):
+    """
+    Execute the command which was selected by the command line arguments.
+    """
+
     if args.bootstrap_config:
         core.bootstrap_config(configfile_path=args.configfile_path)
         exit()
@@ -79,14 +168,52 @@ def main():
         core.print_config(configfile_path=args.configfile_path, datadir_path=args.datadir_path)
         exit()
 
-    elif args.update_all_repos:
-        core.update_all_repos(configfile_path=args.configfile_path, datadir_path=args.datadir_path)
+    elif args.daemon:
+        daemon.run_daemon(
+            configfile_path=args.configfile_path, datadir_path=args.datadir_path, jobs=args.jobs
+        )
+        exit()
+
+    elif args.rescan_repos:
+        core.rescan_repos(configfile_path=args.configfile_path, datadir_path=args.datadir_path)
         exit()
 
+    elif args.migrate_layout:
+        core.migrate_content_layout(
+            args.reponame,
+            args.migrate_layout,
+            configfile_path=args.configfile_path,
+            datadir_path=args.datadir_path,
+        )
+        exit()
+
+    elif args.maintenance:
+        core.maintain_repos(configfile_path=args.configfile_path, datadir_path=args.datadir_path)
+        exit()
+
+    elif args.update_all_repos:
+        failed_sources = core.update_all_repos(
+            configfile_path=args.configfile_path,
+            datadir_path=args.datadir_path,
+            jobs=args.jobs,
+            parallel_repos=args.parallel_repos,
+            full_rescan=args.full_rescan,
+            metrics_paths=(args.metrics_json, args.metrics_prom),
+        )
+        exit(1 if failed_sources else 0)
+
     else:
         # this is executed if no argument is passed
-        core.update_repo(args.reponame)
-        exit()
+        failed_sources = core.update_repo(
+            args.reponame,
+            configfile_path=args.configfile_path,
+            datadir_path=args.datadir_path,
+            jobs=args.jobs,
+            full_rescan=args.full_rescan,
+            metrics_paths=(args.metrics_json, args.metrics_prom),
+        )
+        # failed downloads are reported but do not prevent the commit of the other sources
+        exit(1 if failed_sources else 0)
 
 
 if __name__ == "__main__":
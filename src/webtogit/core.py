@@ -1,23 +1,45 @@
+from __future__ import annotations  # annotations like `git.Repo` must not trigger imports
+
 import os
 import sys
-import requests
+import json
+import hashlib
+import tempfile
+import shutil
 from typing import List
 import textwrap
 import logging
+import time
+import copy
+from urllib.parse import urlparse, urlsplit, urlunsplit
 
-import git
-import yaml
 import appdirs
-from ipydex import IPS, activate_ips_on_exception, TracerFactory
 
 from . import util as u
-
-
-# debugging facilities
-activate_ips_on_exception()
-ST = TracerFactory()
-
-activate_ips_on_exception()
+from .release import APPNAME
+from .sessions import SessionManager
+from .ratelimit import TokenBucket, parse_retry_after, get_backoff_delay
+from .metrics import RunMetrics
+from .filters import compile_filters, filter_file
+from .adapters import HttpAdapter, create_adapters, select_adapter, apply_changeset
+
+# (the constants and classes of the storage module are also available via the package)
+from .storage import (
+    REPO_DATA_DIR_NAME,
+    JOURNAL_FILE_NAME,
+    MMAP_THRESHOLD,
+    RunJournal,
+    WorktreeStorage,
+    ObjectStorage,
+    STORAGE_BACKENDS,
+)
+
+# heavy modules are imported on first use (this keeps the startup of the cli fast)
+git = u.LazyModule("git")
+yaml = u.LazyModule("yaml")
+requests = u.LazyModule("requests")
+asyncio = u.LazyModule("asyncio")
+futures = u.LazyModule("concurrent.futures")
 
 safty_explanation = """
 # The presence (not the content) of this file is checked before the repo is purged.
@@ -31,11 +53,57 @@ log.txt
 
 {safty_explanation}
 .webtogit
+
+# internal state of webtogit (e.g. cache validators of the sources)
+.webtogit-state.json
+
+# temporary files of unfinished downloads
+*.webtogit-tmp
+
+# cache of the parsed sources files
+.webtogit-sources-cache.json
+
+# journal of an unfinished run
+.webtogit-journal.jsonl
+
+# texts of the last archived revisions (changeset mode of etherpad sources)
+.webtogit-pads/
 """
 
-APPNAME = "webtogit"
 DEFAULT_REPO_NAME = "archived-webdocs"
 
+DEFAULT_JOBS = 4
+DEFAULT_JOBS_PER_HOST = 2
+
+# thresholds and parameters for the automatic maintenance (repack/gc) of the repos
+DEFAULT_MAINTENANCE_LOOSE_OBJECTS = 2000
+DEFAULT_MAINTENANCE_PACKS = 20
+DEFAULT_MAINTENANCE_WINDOW = 50
+DEFAULT_MAINTENANCE_DEPTH = 50
+
+# default interval between two downloads of a source (used by daemon mode and adaptive polling)
+DEFAULT_INTERVAL = "1d"
+
+# bounds and factor for adaptive polling
+DEFAULT_MIN_INTERVAL = "5m"
+DEFAULT_MAX_INTERVAL = "7d"
+DEFAULT_BACKOFF_FACTOR = 2
+
+# a source counts as due if this fraction of its interval is left (compensate for cron jitter)
+POLL_TOLERANCE = 0.1
+
+# maximum size (in bytes) of one downloaded source
+DEFAULT_MAX_SOURCE_SIZE = 100 * 1024**2
+
+# retries of failed downloads (HTTP status codes which indicate a temporary problem)
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 1
+DEFAULT_MAX_RETRY_DELAY = 300
+
+# changeset mode of etherpad sources: if more revisions are missing, the whole text is requested
+DEFAULT_MAX_CHANGESETS = 100
+
 DEFAULT_DATADIR_PATH = appdirs.user_data_dir(appname=APPNAME)
 DEFAULT_CONFIGFILE_PATH = os.path.join(appdirs.user_config_dir(appname=APPNAME), "settings.yml")
 
@@ -77,6 +145,84 @@ def generate_default_configfile_content(datadir_path: str) -> str:
     default_repo_name: "{DEFAULT_REPO_NAME}"
 
     readme_content: "This repo was generated by webtogit\\n"
+
+    # number of sources which are downloaded concurrently (can be overridden by `--jobs N`)
+    jobs: {DEFAULT_JOBS}
+
+    # maximum number of concurrent downloads from the same host
+    jobs_per_host: {DEFAULT_JOBS_PER_HOST}
+
+    # maximum size of one source in bytes (can be overridden by the key `max_size` of a source)
+    max_source_size: {DEFAULT_MAX_SOURCE_SIZE}
+
+    # api keys of etherpad instances {{host: key}}; the api is used to check cheaply whether a pad
+    # changed (see `type` of a source); without api key the pads are always downloaded
+    # etherpad_api_keys:
+    #   pad.example.org: "secret"
+
+    # etherpad sources with `mode: changesets` only request the changesets since the last run;
+    # if more revisions are missing, the whole text is requested
+    etherpad_max_changesets: {DEFAULT_MAX_CHANGESETS}
+
+    # normalization filters which remove volatile parts of the contents of all sources (before
+    # the filters of the individual source, key `filters`); possible types: regex (with optional
+    # replace), drop_lines, json_remove_keys
+    # filters:
+    #   - regex: 'name="csrf_token" value="[^"]*"'
+    #     replace: 'name="csrf_token" value=""'
+    #   - drop_lines: "^Last edited"
+    #   - json_remove_keys: [timestamp, views]
+
+    # HTTP settings: timeout (in seconds), number of kept-alive connections per host
+    # (default: value of jobs_per_host) and additional request headers
+    http_timeout: 60
+    # http_pool_maxsize: {DEFAULT_JOBS_PER_HOST}
+    # http_headers:
+    #   User-Agent: "webtogit"
+
+    # rate limiting: requests per second per host (default: unlimited) and the number of
+    # requests which may be sent at once; rate_limits overrides the rate for individual hosts.
+    # Additionally, a source can lower the rate of its host by the key `rate_limit`.
+    # rate_limit: 2
+    # rate_burst: {DEFAULT_JOBS_PER_HOST}
+    # rate_limits:
+    #   etherpad.wikimedia.org: 0.5
+
+    # retries of downloads which failed temporarily (connection errors, status 429, 502-504):
+    # exponential backoff (with jitter) starting at retry_backoff seconds; a `Retry-After` header
+    # of the server is honored (for all sources of this host) up to max_retry_delay seconds
+    max_retries: {DEFAULT_MAX_RETRIES}
+    retry_backoff: {DEFAULT_RETRY_BACKOFF}
+    max_retry_delay: {DEFAULT_MAX_RETRY_DELAY}
+
+    # automatic maintenance of the repos: incremental repack if the number of loose objects
+    # exceeds maintenance_loose_objects, gc if the number of packs exceeds maintenance_packs
+    auto_maintenance: true
+    maintenance_loose_objects: {DEFAULT_MAINTENANCE_LOOSE_OBJECTS}
+    maintenance_packs: {DEFAULT_MAINTENANCE_PACKS}
+    maintenance_window: {DEFAULT_MAINTENANCE_WINDOW}
+    maintenance_depth: {DEFAULT_MAINTENANCE_DEPTH}
+
+    # default interval between two downloads of a source in daemon mode (`--daemon`);
+    # can be set for each source by the key `interval` (e.g. 300, "5m", "2h", "1d")
+    default_interval: "{DEFAULT_INTERVAL}"
+
+    # adaptive polling: the interval of each source is multiplied by backoff_factor if it did not
+    # change and divided by it if it changed (bounded by min_interval and max_interval).
+    # This also applies to normal (cron-triggered) runs: sources which are not due are skipped.
+    adaptive_polling: false
+    min_interval: "{DEFAULT_MIN_INTERVAL}"
+    max_interval: "{DEFAULT_MAX_INTERVAL}"
+    backoff_factor: {DEFAULT_BACKOFF_FACTOR}
+
+    # timing metrics of every run: JSON summary and file for the textfile collector of the
+    # Prometheus node exporter (can be overridden by `--metrics-json` and `--metrics-prom`)
+    # metrics_json_path: "~/.local/state/webtogit/last-run.json"
+    # metrics_prometheus_path: "/var/lib/node_exporter/textfile_collector/webtogit.prom"
+
+    # number of repos which are processed in parallel processes by `--update-all-repos`
+    # (can be overridden by `--parallel-repos N`)
+    parallel_repos: 1
     """
 
     return textwrap.dedent(DEFAULT_CONFIGFILE_CONTENT)
@@ -102,32 +248,215 @@ def generate_default_sources_content():
 
 CHECKFILE_NAME = f".{APPNAME}"
 
-# name of the directory inside the repo which contains the actual data
-REPO_DATA_DIR_NAME = "content"
+# possible layouts of the data directory (setting `content_layout`, see `get_content_path`)
+CONTENT_LAYOUTS = ("flat", "hash", "host")
+
+# number of hex digits of the subdirectories of the layout "hash" (2 -> 256 subdirectories)
+HASH_SHARD_LENGTH = 2
+
+# name of the optional file (inside the repo dir) which overrides settings for this repo
+REPO_SETTINGS_FILE_NAME = f"{APPNAME}-settings.yml"
+
+# name of the file (inside the repo dir) which caches the parsed sources files
+SOURCES_CACHE_FILE_NAME = f".{APPNAME}-sources-cache.json"
+
+# must be increased if the format of the normalized sources changes
+SOURCES_CACHE_VERSION = 1
+
+# name of the file (inside the data dir) which lists the known repos (avoids opening every repo)
+REGISTRY_FILE_NAME = f".{APPNAME}-registry.json"
+
+# must be increased if the format of the registry changes
+REGISTRY_VERSION = 1
+
+# name of the file (inside the repo dir) which stores per-source information between runs
+STATEFILE_NAME = f".{APPNAME}-state.json"
+
+# directory (inside the repo dir) for the texts of the sources in changeset mode
+CHANGESET_CACHE_DIR_NAME = f".{APPNAME}-pads"
+
+# possible values of the key `mode` of a source
+SOURCE_MODES = ("export", "changesets")
+
+# downloads are written to disk in chunks of this size (in bytes)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# suffix of temporary files (downloads in progress)
+TMPFILE_SUFFIX = f".{APPNAME}-tmp"
+
+# internal files of webtogit inside the repo dir. Repos which were created before some of these
+# files were introduced lack the patterns in .gitignore -> they are added to `.git/info/exclude`
+INTERNAL_FILE_PATTERNS = (
+    STATEFILE_NAME,
+    f"*{TMPFILE_SUFFIX}",
+    SOURCES_CACHE_FILE_NAME,
+    JOURNAL_FILE_NAME,
+    f"{CHANGESET_CACHE_DIR_NAME}/",
+)
 
 
 class ObsoleteFunctionError(RuntimeError):
     pass
 
 
+class FetchError(ValueError):
+    """
+    A source could not be downloaded because of an unexpected HTTP status code
+    """
+
+    def __init__(self, msg, status_code=None, retry_after=None):
+        super().__init__(msg)
+        self.status_code = status_code
+
+        # seconds to wait before the next request (`Retry-After` header of the response)
+        self.retry_after = retry_after
+
+    @property
+    def is_temporary(self):
+        return self.status_code in RETRY_STATUS_CODES
+
+
+class FetchTask:
+    """
+    Everything which is needed to download one source of one repo
+    """
+
+    def __init__(
+        self,
+        sdict: dict,
+        repo_dir: str,
+        validators: dict = None,
+        max_size: int = None,
+        target_dir: str = None,
+        content_path: str = None,
+        filters: list = None,
+        adapter: HttpAdapter = None,
+    ):
+        self.sdict = sdict
+        self.url = sdict["url"]
+        self.repo_dir = repo_dir
+
+        # final path of the file (relative to the data directory, depends on the content layout)
+        self.content_path = content_path or sdict["name"]
+
+        # journal entry of an interrupted run which already wrote the file (no download necessary)
+        self.resume_entry = None
+
+        # the download is streamed to a temporary file in this directory
+        self.target_dir = target_dir or os.path.join(repo_dir, REPO_DATA_DIR_NAME)
+
+        # cache validators of the last download (keys: "etag", "last_modified", "revision")
+        self.validators = validators or {}
+
+        # maximum number of bytes (None means: no limit)
+        self.max_size = max_size
+
+        # compiled normalization filters which are applied before the content is stored
+        self.filters = filters or []
+
+        # knowledge about the pad software (e.g. a cheap probe for the revision)
+        self.adapter = adapter or HttpAdapter()
+
+        # cache of the last archived text (only for sources in changeset mode)
+        self.changeset_cache_path = None
+
+
+class FetchResult:
+    """
+    Outcome of downloading one source
+    """
+
+    def __init__(
+        self,
+        url,
+        tmp_path=None,
+        size=None,
+        sha256=None,
+        not_modified=False,
+        etag=None,
+        last_modified=None,
+        error=None,
+        resumed=False,
+        revision=None,
+    ):
+        self.url = url
+
+        # the downloaded content is stored in a temporary file (next to its final destination)
+        self.tmp_path = tmp_path
+        self.size = size
+        self.sha256 = sha256
+
+        # True if the server answered `304 Not Modified` to a conditional request
+        self.not_modified = not_modified
+
+        # validators for the next (conditional) request
+        self.etag = etag
+        self.last_modified = last_modified
+
+        # revision of the document reported by the probe of the adapter (if any)
+        self.revision = revision
+
+        # description of the error if the download failed
+        self.error = error
+
+        # True if the content was already written by an interrupted run (see `RunJournal`)
+        self.resumed = resumed
+
+
 class Core:
     """
     Main class which holds all information
     """
 
-    def __init__(self, configfile_path=None, datadir_path=None):
+    def __init__(self, configfile_path=None, datadir_path=None, jobs=None):
+
+        # timings of the phases and of the requests (see `export_metrics`)
+        self.metrics = RunMetrics()
 
-        self.datadir_path = resolve_path_arg(datadir_path, "DATA")
-        self.configfile_path = resolve_path_arg(configfile_path, "CONFIG")
+        # all paths are absolute -> no dependency on the current working directory
+        self.datadir_path = os.path.abspath(resolve_path_arg(datadir_path, "DATA"))
+        self.configfile_path = os.path.abspath(resolve_path_arg(configfile_path, "CONFIG"))
         self.configdir = os.path.split(self.configfile_path)[0]
 
         self.config = None
 
-        self._ensure_existing_dirs()
-        self.load_settings()
+        with self.metrics.phase("config_load"):
+            self._ensure_existing_dirs()
+            self.load_settings()
+
+        # concurrency settings for downloading (explicit argument takes precedence)
+        self.jobs = jobs or self.config.get("jobs", DEFAULT_JOBS)
+        self.jobs_per_host = self.config.get("jobs_per_host", DEFAULT_JOBS_PER_HOST)
+        self.max_source_size = self.config.get("max_source_size", DEFAULT_MAX_SOURCE_SIZE)
+
+        # rate limiting and retries
+        self.rate_limit = self.config.get("rate_limit")
+        self.rate_limits = self.config.get("rate_limits") or {}
+        self.rate_burst = self.config.get("rate_burst", self.jobs_per_host)
+        self.max_retries = self.config.get("max_retries", DEFAULT_MAX_RETRIES)
+        self.retry_backoff = self.config.get("retry_backoff", DEFAULT_RETRY_BACKOFF)
+        self.max_retry_delay = self.config.get("max_retry_delay", DEFAULT_MAX_RETRY_DELAY)
+        self.max_changesets = self.config.get("etherpad_max_changesets", DEFAULT_MAX_CHANGESETS)
+
+        # adapters for specific pad software (see `adapters.select_adapter`)
+        self.adapters = create_adapters(self.config)
+
+        # pooled http sessions (one per host) which are shared by all sources and repos
+        self.session_manager = SessionManager(
+            timeout=self.config.get("http_timeout"),
+            pool_maxsize=self.config.get("http_pool_maxsize", self.jobs_per_host),
+            headers=self.config.get("http_headers"),
+        )
+
+        # cache for per-repo objects
+        self._repo_settings = {}
+        self._storages = {}
+
+        # sources which could not be downloaded in the last run: {repodir_path: {name: error}}
+        self.failed_sources = {}
 
-        self.repo_paths = None
-        self.find_repos()
+        # repos are discovered lazily (see `repo_paths`)
+        self._repo_paths = None
 
     def _ensure_existing_dirs(self):
 
@@ -143,27 +472,97 @@ class Core:
             err_not_bootstrapped_stage1(self.configfile_path)
             exit(2)  # do not use 1 here to discriminate from uncached exception
 
+    @property
+    def repo_paths(self) -> tuple:
+        if self._repo_paths is None:
+            self.refresh_repo_paths()
+        return self._repo_paths
+
+    @property
+    def registry_path(self) -> str:
+        return os.path.join(self.datadir_path, REGISTRY_FILE_NAME)
+
+    def refresh_repo_paths(self) -> tuple:
+        """
+        Determine the repo paths from the registry file if it is still valid (i.e. no entry of the
+        data directory was added, removed or renamed since it was written). Otherwise rescan.
+        """
+
+        with self.metrics.phase("repo_discovery"):
+            registry = self.load_registry()
+        if registry is None:
+            return self.find_repos()
+
+        self._repo_paths = tuple(
+            os.path.join(self.datadir_path, name) for name in registry["repos"]
+        )
+        return self._repo_paths
+
     def find_repos(self) -> tuple:
+        """
+        Scan the data directory for repos (this opens every candidate) and rebuild the registry.
+        """
 
-        os.chdir(self.datadir_path)
-        dircontent = os.listdir("./")
-        repos = []
-        for name in dircontent:
-            if not os.path.isdir(name):
-                continue
-            if not os.path.isfile(os.path.join(name, CHECKFILE_NAME)):
-                continue
+        with self.metrics.phase("repo_discovery"):
+            dircontent = os.listdir(self.datadir_path)
+            repos = []
+            for name in sorted(dircontent):
+                path = os.path.join(self.datadir_path, name)
+                if not os.path.isdir(path):
+                    continue
+                if not os.path.isfile(os.path.join(path, CHECKFILE_NAME)):
+                    continue
 
-            try:
-                r = git.Repo(name)
-            except (git.InvalidGitRepositoryError, git.NoSuchPathError) as err:
-                continue
+                try:
+                    r = git.Repo(path)
+                except (git.InvalidGitRepositoryError, git.NoSuchPathError) as err:
+                    continue
+
+                repos.append(path)
+
+            self._repo_paths = tuple(repos)
+            self.save_registry()
+
+        return self._repo_paths
 
-            repos.append(os.path.join(self.datadir_path, name))
+    def load_registry(self) -> dict:
+        """
+        :return:    the content of the registry file or None (missing, outdated or invalid)
+        """
+
+        try:
+            with open(self.registry_path, "r", encoding="utf8") as jsonfile:
+                registry = json.load(jsonfile)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if registry.get("version") != REGISTRY_VERSION:
+            return None
+
+        if registry.get("datadir_mtime_ns") != os.stat(self.datadir_path).st_mtime_ns:
+            return None
+
+        # changes inside a repo dir do not affect the mtime of the data dir -> cheap extra check
+        for name in registry["repos"]:
+            if not os.path.isfile(os.path.join(self.datadir_path, name, CHECKFILE_NAME)):
+                return None
 
-        self.repo_paths = tuple(repos)
+        return registry
 
-        return self.repo_paths
+    def save_registry(self):
+
+        # create the file first because this changes the mtime of the data directory;
+        # afterwards it is overwritten in place (which leaves the mtime unchanged)
+        if not os.path.isfile(self.registry_path):
+            open(self.registry_path, "w").close()
+
+        registry = {
+            "version": REGISTRY_VERSION,
+            "datadir_mtime_ns": os.stat(self.datadir_path).st_mtime_ns,
+            "repos": [os.path.basename(path) for path in self._repo_paths],
+        }
+        with open(self.registry_path, "w", encoding="utf8") as jsonfile:
+            json.dump(registry, jsonfile)
 
     def init_archive_repo(self, repo_name: str) -> git.Repo:
         """
@@ -175,7 +574,6 @@ class Core:
         - dir does not exist -> create dir and init repo
 
         """
-        os.chdir(self.datadir_path)
 
         repodir_path = os.path.join(self.datadir_path, repo_name)
         if repodir_path in self.repo_paths:
@@ -183,7 +581,10 @@ class Core:
             _check_archive_repo(repodir_path)
             return git.Repo.init(repodir_path)
         else:
-            return self._init_archive_repo(repodir_path)
+            r = self._init_archive_repo(repodir_path)
+            self._repo_paths = tuple(sorted(self.repo_paths + (repodir_path,)))
+            self.save_registry()
+            return r
 
     def _init_archive_repo(self, repodir_path: str) -> git.Repo:
         """
@@ -199,22 +600,21 @@ class Core:
             raise FileExistsError(f"{repodir_path} already exists. This si")
 
         r = git.Repo.init(repodir_path)
-        os.chdir(repodir_path)
 
         # prevent the directory from being accidentally deleted
         # this file will be ignored by git due to .gitignore
         fname = CHECKFILE_NAME
-        with open(fname, "w") as txtfile:
+        with open(os.path.join(repodir_path, fname), "w") as txtfile:
             txtfile.write(safty_explanation)
 
         # Create the first files for the repo
         fname = "README.md"
-        with open(fname, "w") as txtfile:
+        with open(os.path.join(repodir_path, fname), "w") as txtfile:
             txtfile.write(self.config["readme_content"])
         r.index.add([fname])
 
         fname = ".gitignore"
-        with open(fname, "w") as txtfile:
+        with open(os.path.join(repodir_path, fname), "w") as txtfile:
             txtfile.write(gitignore_content)
         r.index.add([fname])
 
@@ -223,90 +623,723 @@ class Core:
         # {APPNAME}-sources.yml is not (automatically) part of the repo
         fname = f"{APPNAME}-sources.yml"
         sources_content = generate_default_sources_content()
-        with open(fname, "w") as txtfile:
+        with open(os.path.join(repodir_path, fname), "w") as txtfile:
             txtfile.write(sources_content)
 
         return r
 
     @staticmethod
     def load_webdoc_sources(repo_dir: str) -> list:
+        """
+        Load the list of sources from `webtogit-sources.yml` (including all sub-manifests which
+        are referenced by entries like `- include: other-sources.yml`).
+
+        The normalized entries of every manifest file are cached in `SOURCES_CACHE_FILE_NAME`,
+        i.e. only files which have changed since the last call are parsed.
+        """
 
         sources_path = os.path.join(repo_dir, f"{APPNAME}-sources.yml")
 
-        assert os.path.isfile(sources_path)
-
-        with open(sources_path, "r") as txtfile:
-            raw_sources = yaml.safe_load(txtfile)
-        assert isinstance(raw_sources, list)
-
-        sources = []
-        for s in raw_sources:
-            if isinstance(s, str):
-                d = {
-                    "name": get_padname_from_url(s),
-                    "url": s,
-                }
-                sources.append(d)
-            elif isinstance(s, dict):
-                assert len(s) == 1
-                url, value_obj = list(s.items())[0]
-
-                # assume that there is an inner dict
-                assert isinstance(value_obj, dict)
-                if not "name" in value_obj:
-                    value_obj["name"] = get_padname_from_url(url)
-                value_obj["url"] = url
-
-                sources.append(value_obj)
-            else:
-                raise TypeError(f"unexpexted:{type(s)}")
+        if not os.path.isfile(sources_path):
+            raise FileNotFoundError(sources_path)
+
+        cache_path = os.path.join(repo_dir, SOURCES_CACHE_FILE_NAME)
+        cache = load_sources_cache(cache_path)
+        cache_size = len(cache["files"])
+        cache["modified"] = False
+
+        sources = resolve_manifest(sources_path, cache)
+
+        if cache.pop("modified") or len(cache["files"]) != cache_size:
+            save_sources_cache(cache_path, cache)
+
+        check_sources(sources)
         return sources
 
     @staticmethod
     def goto_repo_data_dir(repodir_path):
-        paddir = os.path.join(repodir_path, REPO_DATA_DIR_NAME)
+        msg = "Changing the working directory is not supported anymore. Use `get_repo_data_dir`."
+        raise ObsoleteFunctionError(msg)
+
+    @staticmethod
+    def get_repo_data_dir(repodir_path: str) -> str:
+        """
+        Return the absolute path of the data directory of the repo (create it if necessary).
+        """
+        paddir = os.path.join(os.path.abspath(repodir_path), REPO_DATA_DIR_NAME)
         os.makedirs(paddir, exist_ok=True)
-        os.chdir(paddir)
+        return paddir
 
     def download_source_contents(self, repo_dir: str):
         """
         iterate over sources dict, download url and save result in file insisde the repo
         """
         sources = self.load_webdoc_sources(repo_dir)
+        tasks = self.prepare_fetch_tasks(repo_dir, sources)
+        results = self.fetch_sources(tasks)
+        return self.write_source_contents(repo_dir, tasks, results)
+
+    def write_source_contents(
+        self,
+        repo_dir: str,
+        tasks: List[FetchTask],
+        results: List[FetchResult],
+        journal: RunJournal = None,
+    ):
+        """
+        Move the (already downloaded) contents to their final place inside the repo. The files are
+        handled sequentially in the order of the sources (independently of the download order).
+        Sources which were reported as not modified are skipped. The normalization filters of
+        a source are applied to the downloaded file first. Files whose (normalized) content did not
+        change are not rewritten (this keeps the stat information in the git index valid).
+
+        If a journal is given, failed sources are recorded (and skipped) and every written file is
+        recorded. Files of an interrupted run (`result.resumed`) are treated like written files.
+
+        :return:    list of the files (paths relative to the data directory) which were
+                    actually written
+        """
+
+        state = self.load_source_state(repo_dir)
+        storage = self.get_storage(repo_dir)
+
+        written_files = []
+        for task, result in zip(tasks, results):
+            fname = task.sdict["name"]
+
+            if result.error is not None:
+                if journal is not None:
+                    journal.record_failed(task, result.error)
+                continue
+
+            if result.not_modified:
+                # the probe might have reported a new revision although the content did not change
+                entry = state.setdefault(fname, {})
+                entry.update(etag=result.etag, last_modified=result.last_modified)
+                if result.revision is not None:
+                    entry["revision"] = result.revision
+                continue
+
+            if task.filters and not result.resumed:
+                result.size, result.sha256 = filter_file(result.tmp_path, task.filters)
+
+            if result.resumed:
+                written_files.append(task.content_path)
+            elif storage.store(task.content_path, result, state.get(fname, {})):
+                written_files.append(task.content_path)
+                if journal is not None:
+                    journal.record_fetched(task, result)
+
+            # keep other information (e.g. concerning adaptive polling)
+            state.setdefault(fname, {}).update(
+                url=result.url,
+                etag=result.etag,
+                last_modified=result.last_modified,
+                revision=result.revision,
+                sha256=result.sha256,
+                **storage.get_file_info(task.content_path),
+            )
+
+        self.save_source_state(repo_dir, state)
+
+        return written_files
+
+    def prepare_fetch_tasks(
+        self, repo_dir: str, sources: list, journal: RunJournal = None
+    ) -> List[FetchTask]:
+        """
+        Create one FetchTask for each source, including the cache validators (for conditional
+        requests) of the last download.
+
+        Validators are only used if the corresponding file is present in the repo. Otherwise
+        a `304 Not Modified` would leave the file missing.
 
-        self.goto_repo_data_dir(repo_dir)
+        If the journal contains the source (i.e. an interrupted run already wrote the file), the
+        download is skipped if the written file can still be used. Otherwise validators are not
+        used because the stored validators might belong to a content which was never committed.
 
+        The normalization filters of the settings (`filters`) apply to all sources of the repo,
+        the filters of a source (key `filters`) are applied afterwards.
+        """
+        state = self.load_source_state(repo_dir)
+        storage = self.get_storage(repo_dir)
+        tmp_dir = storage.get_tmp_dir()
+        remove_stale_tmp_files(tmp_dir)
+        layout = self.get_content_layout(repo_dir)
+        repo_filters = compile_filters(self.get_repo_setting(repo_dir, "filters"))
+
+        tasks = []
         for sdict in sources:
-            fname = sdict["name"]
-            url = sdict["url"]
+            content_path = get_content_path(sdict, layout)
+            entry = state.get(sdict["name"], {})
+            if entry.get("url") != sdict["url"]:
+                entry = {}
+            elif not storage.has_file(content_path):
+                entry = {}
+            validators = {
+                "etag": entry.get("etag"),
+                "last_modified": entry.get("last_modified"),
+                "revision": entry.get("revision"),
+            }
+            max_size = sdict.get("max_size", self.max_source_size)
+            task = FetchTask(
+                sdict,
+                repo_dir,
+                validators=validators,
+                max_size=max_size,
+                target_dir=tmp_dir,
+                content_path=content_path,
+                filters=repo_filters + compile_filters(sdict.get("filters")),
+                adapter=select_adapter(sdict, self.adapters),
+            )
+            self._set_source_mode(task, repo_dir)
+
+            resume_entry = journal and journal.get_resume_entry(task)
+            if resume_entry:
+                if storage.can_resume(content_path, resume_entry["sha256"]):
+                    task.resume_entry = resume_entry
+                else:
+                    task.validators = {}
+            tasks.append(task)
+
+        return tasks
+
+    @staticmethod
+    def _set_source_mode(task: FetchTask, repo_dir: str):
+        """
+        Check the key `mode` of the source and prepare the changeset mode (if possible).
+        """
+
+        mode = task.sdict.get("mode", "export")
+        if mode not in SOURCE_MODES:
+            raise ValueError(
+                f"unknown mode of source {task.url}: {mode} (possible: {SOURCE_MODES})"
+            )
+        if mode != "changesets":
+            return
+
+        if not task.adapter.supports_changesets:
+            msg = f"mode changesets is not supported for sources of type {task.adapter.name}"
+            raise ValueError(f"{msg} ({task.url})")
+        if task.adapter.get_probe_url(task.url) is None:
+            logger.warning(f"no api key for {task.url} -> changeset mode is not possible")
+            return
+
+        fname = f"{task.sdict['name']}.json"
+        task.changeset_cache_path = os.path.join(repo_dir, CHANGESET_CACHE_DIR_NAME, fname)
+
+    @staticmethod
+    def load_source_state(repo_dir: str) -> dict:
+        """
+        Load the per-source state (stored in `STATEFILE_NAME`, which is ignored by git).
+        """
+
+        path = os.path.join(repo_dir, STATEFILE_NAME)
+        try:
+            with open(path, "r", encoding="utf8") as jsonfile:
+                return json.load(jsonfile)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logger.warning(f"could not parse {path} -> ignore it")
+            return {}
+
+    @staticmethod
+    def save_source_state(repo_dir: str, state: dict):
+
+        path = os.path.join(repo_dir, STATEFILE_NAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as jsonfile:
+            json.dump(state, jsonfile, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def fetch_sources(self, tasks: List[FetchTask], raise_errors=True) -> List[FetchResult]:
+        """
+        Download the content of all sources (possibly belonging to different repos) concurrently.
+
+        :param tasks:           list of FetchTask objects
+        :param raise_errors:    boolean flag; if False a failed download does not raise an
+                                exception but results in a FetchResult with attribute `error`
+
+        :return:    list of FetchResult objects (in the same order as `tasks`)
+        """
+
+        if not tasks:
+            return []
 
-            res = requests.get(url)
+        with self.metrics.phase("fetch"):
+            return asyncio.run(self.fetch_sources_async(tasks, raise_errors))
+
+    async def fetch_sources_async(
+        self, tasks: List[FetchTask], raise_errors=True
+    ) -> List[FetchResult]:
+        """
+        Fetch engine: all downloads share one event loop. The blocking requests are performed
+        by a pool of `self.jobs` threads. Additionally, the number of concurrent requests per host
+        is limited by `self.jobs_per_host` and their rate by a token bucket per host.
+        Temporary failures are retried (see `fetch_with_retries`).
+        """
+
+        loop = asyncio.get_running_loop()
+
+        # the semaphores must be created inside the running loop
+        host_semaphores = {}
+        for task in tasks:
+            host = urlparse(task.url).netloc
+            if host not in host_semaphores:
+                host_semaphores[host] = asyncio.Semaphore(max(1, self.jobs_per_host))
+        token_buckets = self.create_token_buckets(tasks)
+
+        with futures.ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+
+            async def fetch(task):
+                host = urlparse(task.url).netloc
+
+                if task.resume_entry is not None:
+                    # the file was already written by an interrupted run
+                    entry = task.resume_entry
+                    return FetchResult(
+                        task.url,
+                        sha256=entry["sha256"],
+                        etag=entry["etag"],
+                        last_modified=entry["last_modified"],
+                        resumed=True,
+                    )
+
+                async def run_request(func, *args):
+                    await token_buckets[host].acquire()
+                    return await loop.run_in_executor(executor, func, *args)
+
+                async def fetch_once():
+                    # wait for the host-slot before occupying a worker thread
+                    async with host_semaphores[host]:
+                        revision = None
+                        if task.adapter.get_probe_url(task.url):
+                            revision = await run_request(self.probe_source, task)
+                            if revision is not None and revision == task.validators.get(
+                                "revision"
+                            ):
+                                return FetchResult(
+                                    task.url,
+                                    not_modified=True,
+                                    etag=task.validators.get("etag"),
+                                    last_modified=task.validators.get("last_modified"),
+                                    revision=revision,
+                                )
+
+                        if task.changeset_cache_path:
+                            if revision is None:
+                                # the export has another format than the reconstructed text
+                                msg = f"revision of {task.url} is unknown (changeset mode)"
+                                raise FetchError(msg)
+                            return await self.fetch_changesets(task, int(revision), run_request)
+
+                        result = await run_request(self.fetch_source, task)
+
+                        # the probe was sent first, i.e. a change in the meantime is not missed
+                        result.revision = revision
+                        return result
+
+                return await self.fetch_with_retries(task, fetch_once, token_buckets[host])
+
+            # `gather` preserves the order
+            results = await asyncio.gather(
+                *(fetch(task) for task in tasks), return_exceptions=True
+            )
+
+        errors = [res for res in results if isinstance(res, BaseException)]
+        if not errors:
+            return results
+
+        if raise_errors or any(not isinstance(err, Exception) for err in errors):
+            # do not leave the temporary files of the successful downloads behind
+            for res in results:
+                if isinstance(res, FetchResult) and res.tmp_path:
+                    os.remove(res.tmp_path)
+            raise errors[0]
+
+        for idx, (task, res) in enumerate(zip(tasks, results)):
+            if isinstance(res, Exception):
+                logger.warning(f"download of {task.url} failed: {res}")
+                results[idx] = FetchResult(task.url, error=f"{type(res).__name__}: {res}")
+
+        return results
+
+    def fetch_unique_sources(self, tasks: List[FetchTask]) -> List[FetchResult]:
+        """
+        Like `fetch_sources` (with `raise_errors=False`) but a url which is a source of several
+        repos is fetched only once. For every further task the downloaded file is copied into its
+        temporary directory (each repo stores it under its own name and applies its own filters).
+
+        Conditional requests are only sent if the validators of all tasks of the url agree.
+        Tasks of interrupted runs and in changeset mode depend on their repo and are not shared.
+        """
+
+        groups = {}
+        for idx, task in enumerate(tasks):
+            if task.resume_entry is not None or task.changeset_cache_path:
+                key = ("unshared", idx)
+            else:
+                key = (normalize_url(task.url), task.max_size, task.adapter.name)
+            groups.setdefault(key, []).append(idx)
+
+        unique_tasks = []
+        for indices in groups.values():
+            task = tasks[indices[0]]
+            if any(tasks[idx].validators != task.validators for idx in indices[1:]):
+                # some repos would need the content anyway
+                task.validators = {}
+            unique_tasks.append(task)
+
+        unique_results = self.fetch_sources(unique_tasks, raise_errors=False)
+
+        results = [None] * len(tasks)
+        for indices, result in zip(groups.values(), unique_results):
+            results[indices[0]] = result
+            for idx in indices[1:]:
+                # the url as given in the sources of the repo (see `prepare_fetch_tasks`)
+                results[idx] = copy.copy(result)
+                results[idx].url = tasks[idx].url
+                if result.tmp_path:
+                    results[idx].tmp_path = copy_to_tmp_file(result.tmp_path, tasks[idx])
+
+        return results
+
+    def create_token_buckets(self, tasks: List[FetchTask]) -> dict:
+        """
+        Create one token bucket per host. Its rate is `rate_limits[host]` or `rate_limit`
+        (settings.yml). A source can lower the rate of its host by the key `rate_limit` (the
+        smallest value of all sources of the host is used).
+
+        :return:    dict like {host: TokenBucket}
+        """
+
+        rates = {}
+        for task in tasks:
+            host = urlparse(task.url).netloc
+            if host not in rates:
+                rates[host] = self.rate_limits.get(host, self.rate_limit)
+
+            source_rate = task.sdict.get("rate_limit")
+            if source_rate and (not rates[host] or source_rate < rates[host]):
+                rates[host] = source_rate
+
+        return {host: TokenBucket(rate, burst=self.rate_burst) for host, rate in rates.items()}
+
+    async def fetch_with_retries(self, task: FetchTask, fetch_once, token_bucket: TokenBucket):
+        """
+        Call the coroutine function `fetch_once` until it succeeds or the number of retries is
+        exhausted. Only temporary failures (connection errors, status 429, 502-504) are retried.
+
+        After a temporary HTTP error the token bucket (i.e. all sources of the host) is paused for
+        the backoff delay or the time demanded by the `Retry-After` header (if it is longer).
+        """
+
+        attempt = 0
+        while True:
+            try:
+                return await fetch_once()
+            except FetchError as err:
+                if not err.is_temporary or attempt >= self.max_retries:
+                    raise
+                delay = get_backoff_delay(attempt, self.retry_backoff, self.max_retry_delay)
+                if err.retry_after is not None:
+                    if err.retry_after > self.max_retry_delay:
+                        raise
+                    delay = max(delay, err.retry_after)
+                token_bucket.pause(delay)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                delay = get_backoff_delay(attempt, self.retry_backoff, self.max_retry_delay)
+
+            attempt += 1
+            logger.debug(f"retry {attempt}/{self.max_retries} for {task.url} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def fetch_changesets(self, task: FetchTask, revision: int, run_request) -> FetchResult:
+        """
+        Changeset mode of etherpad sources: reconstruct the text of `revision` from the cached
+        text of the last archived revision and the changesets since then (one small api request
+        per revision). If there is no usable cache or more than `etherpad_max_changesets`
+        revisions are missing, the text of the revision is requested as a whole.
+
+        :param run_request:     coroutine function which calls a function (and its arguments) in
+                                a worker thread (respecting the rate limit of the host)
+        """
+
+        adapter = task.adapter
+        cache = load_changeset_cache(task.changeset_cache_path)
+
+        text = None
+        if cache is not None and 0 <= revision - cache["revision"] <= self.max_changesets:
+            text = cache["text"]
+            try:
+                for rev in range(cache["revision"] + 1, revision + 1):
+                    api_url = adapter.get_changeset_url(task.url, rev)
+                    changeset = await run_request(
+                        self.request_api, task, api_url, adapter.parse_changeset_response
+                    )
+                    text = apply_changeset(text, changeset)
+            except ValueError as err:
+                logger.warning(f"changesets of {task.url} are not usable ({err}) -> get the text")
+                text = None
+
+        if text is None:
+            api_url = adapter.get_text_url(task.url, revision)
+            text = await run_request(self.request_api, task, api_url, adapter.parse_text_response)
+
+        # the cache contains its revision, i.e. it stays consistent if the run is interrupted
+        save_changeset_cache(task.changeset_cache_path, revision, text)
+
+        tmp_path, size, digest = write_tmp_file(text.encode("utf8", "surrogatepass"), task)
+        return FetchResult(
+            task.url, tmp_path=tmp_path, size=size, sha256=digest, revision=str(revision)
+        )
+
+    def request_api(self, task: FetchTask, api_url: str, parse):
+        """
+        Send a (small) metadata request concerning a source (e.g. the probe of the adapter).
+        The url might contain an api key, i.e. it must not be part of error messages.
+
+        :param parse:   function which converts the body of the response (bytes)
+        """
+
+        timing = {}
+        error = None
+        start = time.perf_counter()
+        try:
+            try:
+                res = self.session_manager.get(api_url)
+            except requests.RequestException as err:
+                # connection errors are retried (see `fetch_with_retries`)
+                raise type(err)(f"api request for {task.url} failed") from None
+
+            timing.update(status_code=res.status_code, ttfb=time.perf_counter() - start)
+            if not res.status_code == 200:
+                raise FetchError(
+                    f"unexpected status code ({res.status_code}) of api request for {task.url}",
+                    status_code=res.status_code,
+                    retry_after=parse_retry_after(res.headers.get("Retry-After")),
+                )
+            timing["size"] = len(res.content)
+            return parse(res.content)
+        except Exception as err:
+            error = f"{type(err).__name__}: {err}"
+            raise
+        finally:
+            self.metrics.record_request(task.url, task.repo_dir, error=error, **timing)
+
+    def probe_source(self, task: FetchTask) -> str:
+        """
+        Send the probe request of the adapter of the source.
+
+        :return:    current revision of the document or None if the probe failed permanently
+                    (then the content is downloaded anyway). Temporary failures are raised
+                    (they are retried, see `fetch_with_retries`).
+        """
+
+        probe_url = task.adapter.get_probe_url(task.url)
+        try:
+            return self.request_api(task, probe_url, task.adapter.parse_probe_response)
+        except (requests.ConnectionError, requests.Timeout):
+            raise
+        except Exception as err:
+            if isinstance(err, FetchError) and err.is_temporary:
+                raise
+            logger.debug(f"probe for {task.url} failed ({err}) -> download the content")
+            return None
+
+    def fetch_source(self, task: FetchTask) -> FetchResult:
+        """
+        Download one source (streamed into a temporary file). If validators are present
+        a conditional request is sent. The timings of the request are recorded in `self.metrics`.
+        """
+
+        timing = {}
+        error = None
+        try:
+            return self._fetch_source(task, timing)
+        except Exception as err:
+            error = f"{type(err).__name__}: {err}"
+            raise
+        finally:
+            self.metrics.record_request(task.url, task.repo_dir, error=error, **timing)
+
+    def _fetch_source(self, task: FetchTask, timing: dict) -> FetchResult:
+        """
+        :param timing:  dict which is filled with the keys `status_code`, `ttfb` (time to first
+                        byte), `transfer` (time for reading the body) and `size`
+        """
+        url = task.url
+        validators = task.validators
+
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        start = time.perf_counter()
+        with self.session_manager.get(url, headers=headers, stream=True) as res:
+            # with `stream=True` the request returns as soon as the headers are received
+            timing.update(status_code=res.status_code, ttfb=time.perf_counter() - start)
+
+            if res.status_code == 304 and headers:
+                return FetchResult(
+                    url,
+                    not_modified=True,
+                    etag=validators.get("etag"),
+                    last_modified=validators.get("last_modified"),
+                )
             if not res.status_code == 200:
-                raise ValueError(f"unexpected status code for url {url}")
+                raise FetchError(
+                    f"unexpected status code ({res.status_code}) for url {url}",
+                    status_code=res.status_code,
+                    retry_after=parse_retry_after(res.headers.get("Retry-After")),
+                )
 
-            with open(fname, "wb") as txtfile:
-                txtfile.write(res.content)
+            content_length = res.headers.get("Content-Length")
+            if (
+                task.max_size is not None
+                and content_length
+                and int(content_length) > task.max_size
+            ):
+                raise ValueError(
+                    f"content of url {url} exceeds the maximum size ({task.max_size})"
+                )
+
+            start = time.perf_counter()
+            tmp_path, size, digest = stream_to_tmp_file(res, task)
+            timing.update(transfer=time.perf_counter() - start, size=size)
+
+        return FetchResult(
+            url,
+            tmp_path=tmp_path,
+            size=size,
+            sha256=digest,
+            etag=res.headers.get("ETag"),
+            last_modified=res.headers.get("Last-Modified"),
+        )
 
     def get_repo(self, repodir_path: str) -> git.Repo:
-        assert repodir_path in self.repo_paths
+        # only this repo is checked (no need to discover all repos of the data directory)
+        assert os.path.isfile(os.path.join(repodir_path, CHECKFILE_NAME)), repodir_path
         r = git.Repo(repodir_path)
         return r
 
-    def make_commit(self, repodir_path: str) -> List[str]:
+    def make_commit(self, repodir_path: str, changed_paths: List[str] = None) -> List[str]:
+        """
+        Stage and commit the changes of the data directory (via the storage backend of the repo).
+
+        :param repodir_path:    path of the repo
+        :param changed_paths:   paths (relative to the repo) which were written by the download
+                                step. If given, only these paths are staged and compared to HEAD.
+                                Default: None -> scan the whole data directory.
 
-        os.chdir(repodir_path)
-        r = self.get_repo(repodir_path)
+        :return:                list of changed files
+        """
+
+        storage = self.get_storage(repodir_path)
+        return storage.commit(changed_paths, message="track changes to pads")
+
+    def get_storage(self, repodir_path: str):
+        """
+        Return the storage backend of the repo (configured by the setting `storage_backend`).
+        """
+
+        storage = self._storages.get(repodir_path)
+        if storage is None:
+            backend_name = self.get_repo_setting(repodir_path, "storage_backend", "worktree")
+            try:
+                storage_class = STORAGE_BACKENDS[backend_name]
+            except KeyError:
+                msg = f"unknown storage_backend: {backend_name} (repo: {repodir_path})"
+                raise ValueError(msg)
+            r = self.get_repo(repodir_path)
+            ensure_exclude_patterns(r, INTERNAL_FILE_PATTERNS)
+            storage = storage_class(r, metrics=self.metrics)
+            self._storages[repodir_path] = storage
+
+        return storage
+
+    def get_repo_setting(self, repodir_path: str, key: str, default=None):
+        """
+        Return the value of a setting for a specific repo. Lookup order:
+
+        1. `webtogit-settings.yml` inside the repo dir (optional)
+        2. settings.yml (global configuration)
+        3. default
+        """
+
+        repo_settings = self._repo_settings.get(repodir_path)
+        if repo_settings is None:
+            path = os.path.join(repodir_path, REPO_SETTINGS_FILE_NAME)
+            if os.path.isfile(path):
+                repo_settings = load_config(path) or {}
+            else:
+                repo_settings = {}
+            self._repo_settings[repodir_path] = repo_settings
+
+        if key in repo_settings:
+            return repo_settings[key]
+
+        return self.config.get(key, default)
 
-        r.git.add(REPO_DATA_DIR_NAME)
-        diff_objects = r.index.diff(r.head.commit)
+    def set_repo_setting(self, repodir_path: str, key: str, value):
+        """
+        Store a setting in `webtogit-settings.yml` of the repo (create the file if necessary).
+        """
+
+        path = os.path.join(repodir_path, REPO_SETTINGS_FILE_NAME)
+        if os.path.isfile(path):
+            repo_settings = load_config(path) or {}
+        else:
+            repo_settings = {}
+
+        repo_settings[key] = value
+        with open(path, "w") as txtfile:
+            yaml.safe_dump(repo_settings, txtfile)
+
+        self._repo_settings[repodir_path] = repo_settings
+
+    def get_content_layout(self, repodir_path: str) -> str:
+        layout = self.get_repo_setting(repodir_path, "content_layout", "flat")
+        if layout not in CONTENT_LAYOUTS:
+            msg = f"unknown content_layout: {layout} (repo: {repodir_path})"
+            raise ValueError(msg)
+        return layout
 
-        changedFiles = [do.a_path for do in diff_objects]
+    def migrate_content_layout(self, repodir_path: str, layout: str, print_flag=True) -> List[str]:
+        """
+        Move the files of all sources to the places of the new layout (in one commit, i.e. the
+        history of every file can be followed with `git log --follow`). Then store the new layout
+        in `webtogit-settings.yml`.
+
+        :return:    list of the moved files (new paths relative to the repo)
+        """
+
+        if layout not in CONTENT_LAYOUTS:
+            raise ValueError(f"unknown content_layout: {layout} (possible: {CONTENT_LAYOUTS})")
 
-        if changedFiles:
+        old_layout = self.get_content_layout(repodir_path)
+        storage = self.get_storage(repodir_path)
 
-            r.git.commit(message="track changes to pads")
+        renames = {}
+        for sdict in self.load_webdoc_sources(repodir_path):
+            old_path = get_content_path(sdict, old_layout)
+            new_path = get_content_path(sdict, layout)
+            if old_path != new_path and storage.has_file(old_path):
+                renames[old_path] = new_path
+
+        message = f"change content layout: {old_layout} -> {layout}"
+        moved_files = storage.move(renames, message=message)
+        self.set_repo_setting(repodir_path, "content_layout", layout)
+
+        if print_flag:
+            logger.info(f"{repodir_path}: {message} ({len(moved_files)} files moved)")
 
-        return changedFiles
+        return moved_files
 
     def print_config(self):
         keys = ("configfile_path", "datadir_path", "repo_paths", "number_of_repos")
@@ -330,22 +1363,85 @@ class Core:
             return len(self.repo_paths)
 
     @staticmethod
-    def make_report(changed_files: List[str]) -> str:
+    def make_report(changed_files: List[str], failed_sources: dict = None) -> str:
+        """
+        :param changed_files:   list of changed files
+        :param failed_sources:  dict like {source name: error message} (optional)
+        """
         assert isinstance(changed_files, list)
         report_lines = ["\n", f"{len(changed_files)} files changed:"] + changed_files
 
+        if failed_sources:
+            report_lines.append(f"{len(failed_sources)} sources failed:")
+            for name, error in failed_sources.items():
+                report_lines.append(f"{name}: {error}")
+
         report = "\n".join(report_lines)
         return report
 
-    def handle_all_repos(self, print_flag: str = True):
-        content = os.listdir(self.datadir_path)
+    def export_metrics(self, json_path: str = None, prometheus_path: str = None):
+        """
+        Write the metrics of the run (default paths: settings `metrics_json_path` and
+        `metrics_prometheus_path`; nothing is written if no path is given).
+        """
+
+        json_path = json_path or self.config.get("metrics_json_path")
+        prometheus_path = prometheus_path or self.config.get("metrics_prometheus_path")
+
+        if json_path:
+            self.metrics.write_json(os.path.abspath(os.path.expanduser(json_path)))
+        if prometheus_path:
+            self.metrics.write_prometheus(os.path.abspath(os.path.expanduser(prometheus_path)))
+
+    def handle_all_repos(
+        self, print_flag: str = True, parallel_repos: int = None, full_rescan: bool = False
+    ) -> dict:
+        """
+        Update all repos.
+
+        :param print_flag:      boolean flag to control the output
+        :param parallel_repos:  number of repos which are processed in parallel (in separate
+                                processes); default: `parallel_repos` from settings.yml or 1.
+                                If this is 1 all sources of all repos are fetched together.
+        :param full_rescan:     see `handle_repo`
+
+        :return:    dict like {repodir_path: changed_files}
+        """
 
         if print_flag:
             self.print_config()
 
+        with self.metrics.phase("repo_discovery"):
+            repodir_paths = self._find_repos_with_sources(print_flag)
+
+        if parallel_repos is None:
+            parallel_repos = self.config.get("parallel_repos", 1)
+
+        if parallel_repos > 1:
+            return self._handle_repos_in_process_pool(
+                repodir_paths, parallel_repos, print_flag, full_rescan
+            )
+
+        sources_dict = {}
+        for repodir_path in repodir_paths:
+            try:
+                with self.metrics.phase("parse_sources"):
+                    sources = self.load_webdoc_sources(repodir_path)
+                sources_dict[repodir_path] = self.select_due_sources(repodir_path, sources)
+            except Exception as err:
+                # an invalid sources file must not prevent the update of the other repos
+                logger.error(
+                    f"{u.bred('Error:')} could not load the sources of {repodir_path}: {err}"
+                )
+                self.failed_sources[repodir_path] = {"*": str(err)}
+        return self.handle_sources(sources_dict, print_flag, full_rescan)
+
+    def _find_repos_with_sources(self, print_flag: str = True) -> List[str]:
+
         testfile = f"{APPNAME}-sources.yml"
 
-        for name in content:
+        repodir_paths = []
+        for name in os.listdir(self.datadir_path):
             full_path = os.path.join(self.datadir_path, name)
             if not os.path.isdir(full_path):
                 continue
@@ -358,9 +1454,100 @@ class Core:
                     logger.info(msg)
                 continue
 
-            self.handle_repo(full_path, print_flag)
+            repodir_paths.append(full_path)
+
+        return repodir_paths
+
+    def handle_sources(
+        self, sources_dict: dict, print_flag: str = True, full_rescan: bool = False
+    ) -> dict:
+        """
+        Fetch the given sources of (possibly) several repos together (with shared concurrency
+        limits and every url only once, see `fetch_unique_sources`), then write and commit the
+        results repo by repo.
+
+        Failed downloads do not prevent the other sources from being committed. An error while
+        preparing or committing one repo (e.g. an invalid setting) is logged and the remaining
+        repos are processed anyway.
+
+        :param sources_dict:    dict like {repodir_path: list_of_source_dicts}
+
+        :return:    dict like {repodir_path: changed_files}
+        """
 
-    def handle_repo(self, repodir_path: str, print_flag: str = True):
+        changed_files_dict = {}
+        journals = {repodir_path: RunJournal(repodir_path) for repodir_path in sources_dict}
+        tasks_dict = {}
+        with self.metrics.phase("prepare"):
+            for repodir_path, sources in sources_dict.items():
+                try:
+                    tasks_dict[repodir_path] = self.prepare_fetch_tasks(
+                        repodir_path, sources, journals[repodir_path]
+                    )
+                except Exception as err:
+                    logger.error(f"{u.bred('Error:')} could not update {repodir_path}: {err}")
+                    self.failed_sources[repodir_path] = {"*": str(err)}
+                    changed_files_dict[repodir_path] = []
+
+        all_tasks = [task for tasks in tasks_dict.values() for task in tasks]
+        all_results = self.fetch_unique_sources(all_tasks)
+
+        offset = 0
+        for repodir_path, tasks in tasks_dict.items():
+            results = all_results[offset : offset + len(tasks)]
+            offset += len(tasks)
+            try:
+                changed_files_dict[repodir_path] = self._commit_fetched_contents(
+                    repodir_path, tasks, results, print_flag, full_rescan, journals[repodir_path]
+                )
+            except Exception as err:
+                logger.error(f"{u.bred('Error:')} could not update {repodir_path}: {err}")
+                self.failed_sources[repodir_path] = {"*": str(err)}
+                changed_files_dict[repodir_path] = []
+
+        return changed_files_dict
+
+    def _handle_repos_in_process_pool(
+        self,
+        repodir_paths: List[str],
+        parallel_repos: int,
+        print_flag: str = True,
+        full_rescan: bool = False,
+    ) -> dict:
+        """
+        Process the repos independently from each other in a pool of `parallel_repos` processes.
+        Every process creates its own Core instance (with the same configuration). The metrics
+        and the failed sources of the workers are merged into this instance.
+        """
+
+        with futures.ProcessPoolExecutor(max_workers=parallel_repos) as executor:
+            future_dict = {}
+            for repodir_path in repodir_paths:
+                future_dict[repodir_path] = executor.submit(
+                    _handle_repo_in_subprocess,
+                    self.configfile_path,
+                    self.datadir_path,
+                    self.jobs,
+                    repodir_path,
+                    print_flag,
+                    full_rescan,
+                )
+
+            changed_files_dict = {}
+            for repodir_path, future in future_dict.items():
+                try:
+                    changed_files, metrics_summary, failed_sources = future.result()
+                    changed_files_dict[repodir_path] = changed_files
+                    self.metrics.merge(metrics_summary)
+                    self.failed_sources[repodir_path] = failed_sources
+                except Exception as err:
+                    logger.error(f"{u.bred('Error:')} could not update {repodir_path}: {err}")
+                    self.failed_sources[repodir_path] = {"*": str(err)}
+                    changed_files_dict[repodir_path] = []
+
+            return changed_files_dict
+
+    def handle_repo(self, repodir_path: str, print_flag: str = True, full_rescan: bool = False):
         """
         This is the main method for one repo. It performs the following steps:
 
@@ -369,21 +1556,396 @@ class Core:
         2. download files
         3. commit to repo
         4. return and print a report of what as changed
+
+        :param repodir_path:    path of the repo
+        :param print_flag:      boolean flag to control the output
+        :param full_rescan:     boolean flag; if True the whole data directory is staged and
+                                compared to HEAD (instead of only the files written in this run)
         """
 
         if not os.path.isdir(repodir_path):
             err_not_bootstrapped_stage2(repodir_path)
             exit(3)
 
-        self.download_source_contents(repodir_path)
-        changed_files = self.make_commit(repodir_path)
+        journal = RunJournal(repodir_path)
+        with self.metrics.phase("parse_sources"):
+            sources = self.load_webdoc_sources(repodir_path)
+            sources = self.select_due_sources(repodir_path, sources)
+        with self.metrics.phase("prepare"):
+            tasks = self.prepare_fetch_tasks(repodir_path, sources, journal)
+        results = self.fetch_sources(tasks, raise_errors=False)
+
+        return self._commit_fetched_contents(
+            repodir_path, tasks, results, print_flag, full_rescan, journal
+        )
+
+    def _commit_fetched_contents(
+        self,
+        repodir_path: str,
+        tasks: List[FetchTask],
+        results: List[FetchResult],
+        print_flag: str = True,
+        full_rescan: bool = False,
+        journal: RunJournal = None,
+    ) -> List[str]:
+        """
+        Write the fetched contents into the repo, commit and report the changes (and the failed
+        sources, which are also stored in `self.failed_sources`).
+        """
+
+        if journal is None:
+            journal = RunJournal(repodir_path)
+
+        start = time.perf_counter()
+        with self.metrics.phase("write"):
+            written_files = self.write_source_contents(repodir_path, tasks, results, journal)
+
+        if full_rescan:
+            changed_paths = None
+        else:
+            changed_paths = [os.path.join(REPO_DATA_DIR_NAME, path) for path in written_files]
+        changed_files = self.make_commit(repodir_path, changed_paths)
+        journal.finish([task.sdict["name"] for task in tasks])
+
+        # failed sources are not considered by adaptive polling (they are retried next time)
+        fetched_tasks = [task for task, res in zip(tasks, results) if res.error is None]
+        self.update_poll_state(repodir_path, fetched_tasks, changed_files)
+        self.failed_sources[repodir_path] = dict(journal.failed)
 
         if print_flag:
             logger.info(f"\nrepo {u.bright(repodir_path)}:")
-            logger.info(self.make_report(changed_files))
+            logger.info(self.make_report(changed_files, journal.failed))
+
+        if changed_files and self.get_repo_setting(repodir_path, "auto_maintenance", True):
+            with self.metrics.phase("maintenance"):
+                self.maintain_repo(repodir_path, print_flag=print_flag)
+
+        duration = time.perf_counter() - start
+        self.metrics.record_repo(repodir_path, duration, len(changed_files), len(journal.failed))
 
         return changed_files
 
+    def is_adaptive_polling(self, repodir_path: str) -> bool:
+        return bool(self.get_repo_setting(repodir_path, "adaptive_polling", False))
+
+    def get_poll_interval(self, repodir_path: str, sdict: dict, state: dict = None) -> float:
+        """
+        Return the current interval (in seconds) between two downloads of a source: the adapted
+        value (adaptive polling) or the configured value (key `interval` or `default_interval`).
+        """
+
+        value = sdict.get("interval")
+        if value is None:
+            value = self.get_repo_setting(repodir_path, "default_interval", DEFAULT_INTERVAL)
+        interval = u.parse_interval(value)
+
+        if not self.is_adaptive_polling(repodir_path):
+            return interval
+
+        if state is None:
+            state = self.load_source_state(repodir_path)
+
+        return state.get(sdict["name"], {}).get("poll_interval", interval)
+
+    def select_due_sources(self, repodir_path: str, sources: list, now: float = None) -> list:
+        """
+        Adaptive polling: return only those sources whose interval has elapsed since their last
+        download. Without adaptive polling all sources are returned.
+        """
+
+        if not self.is_adaptive_polling(repodir_path):
+            return sources
+
+        if now is None:
+            now = time.time()
+        state = self.load_source_state(repodir_path)
+
+        due_sources = []
+        for sdict in sources:
+            last_poll = state.get(sdict["name"], {}).get("last_poll")
+            interval = self.get_poll_interval(repodir_path, sdict, state)
+            if last_poll is None or now >= last_poll + interval * (1 - POLL_TOLERANCE):
+                due_sources.append(sdict)
+
+        return due_sources
+
+    def update_poll_state(
+        self, repodir_path: str, tasks: List[FetchTask], changed_files: List[str], now=None
+    ):
+        """
+        Adaptive polling: record the result of the last download of every source and adapt its
+        interval (back off exponentially if unchanged, tighten if changed).
+        """
+
+        if not self.is_adaptive_polling(repodir_path) or not tasks:
+            return
+
+        def interval_setting(key, default):
+            return u.parse_interval(self.get_repo_setting(repodir_path, key, default))
+
+        min_interval = interval_setting("min_interval", DEFAULT_MIN_INTERVAL)
+        max_interval = interval_setting("max_interval", DEFAULT_MAX_INTERVAL)
+        factor = self.get_repo_setting(repodir_path, "backoff_factor", DEFAULT_BACKOFF_FACTOR)
+
+        if now is None:
+            now = time.time()
+        changed_files = set(changed_files)
+        state = self.load_source_state(repodir_path)
+
+        for task in tasks:
+            fname = task.sdict["name"]
+            interval = self.get_poll_interval(repodir_path, task.sdict, state)
+            entry = state.setdefault(fname, {})
+
+            if os.path.join(REPO_DATA_DIR_NAME, task.content_path) in changed_files:
+                interval = interval / factor
+                entry["last_change"] = now
+                entry["change_count"] = entry.get("change_count", 0) + 1
+            else:
+                interval = interval * factor
+
+            entry["poll_interval"] = min(max(interval, min_interval), max_interval)
+            entry["last_poll"] = now
+            entry["poll_count"] = entry.get("poll_count", 0) + 1
+
+        self.save_source_state(repodir_path, state)
+
+    @staticmethod
+    def get_object_stats(repodir_path: str) -> dict:
+        """
+        Return the output of `git count-objects -v` as dict (sizes in KiB).
+        """
+        r = git.Repo(repodir_path)
+        stats = {}
+        for line in r.git.count_objects("-v").splitlines():
+            key, value = line.split(":", 1)
+            stats[key.strip()] = int(value.strip())
+
+        return stats
+
+    def maintain_repo(
+        self, repodir_path: str, force: bool = False, print_flag: str = True
+    ) -> dict:
+        """
+        Keep the object database of the repo efficient:
+
+        - number of loose objects exceeds `maintenance_loose_objects`: incremental repack
+          (only the loose objects are packed into one new pack)
+        - number of packs exceeds `maintenance_packs` (or `force`): gc (all packs are combined)
+
+        :return:    dict with keys "action", "before", "after" (object stats)
+        """
+
+        def setting(key, default):
+            return self.get_repo_setting(repodir_path, key, default)
+
+        before = self.get_object_stats(repodir_path)
+        loose_limit = setting("maintenance_loose_objects", DEFAULT_MAINTENANCE_LOOSE_OBJECTS)
+        packs_limit = setting("maintenance_packs", DEFAULT_MAINTENANCE_PACKS)
+        window = setting("maintenance_window", DEFAULT_MAINTENANCE_WINDOW)
+        depth = setting("maintenance_depth", DEFAULT_MAINTENANCE_DEPTH)
+
+        r = git.Repo(repodir_path)
+        delta_options = [f"--window={window}", f"--depth={depth}"]
+
+        if force or before["packs"] > packs_limit:
+            action = "gc"
+            r.git.execute(
+                ["git", "-c", f"pack.window={window}", "-c", f"pack.depth={depth}", "gc", "-q"]
+            )
+        elif before["count"] > loose_limit:
+            action = "repack"
+            r.git.repack("-d", "-l", "-q", *delta_options)
+            r.git.prune_packed("-q")
+        else:
+            return {"action": None, "before": before, "after": before}
+
+        after = self.get_object_stats(repodir_path)
+
+        if print_flag:
+            size_before = before["size"] + before["size-pack"]
+            size_after = after["size"] + after["size-pack"]
+            logger.info(
+                f"maintenance ({action}) of {repodir_path}: "
+                f"{before['count']} loose objects, {before['packs']} packs, {size_before} KiB -> "
+                f"{after['count']} loose objects, {after['packs']} packs, {size_after} KiB"
+            )
+
+        return {"action": action, "before": before, "after": after}
+
+    def maintain_all_repos(self, force: bool = True, print_flag: str = True) -> dict:
+        """
+        :return:    dict like {repodir_path: result_of_maintain_repo}
+        """
+        return {
+            repodir_path: self.maintain_repo(repodir_path, force=force, print_flag=print_flag)
+            for repodir_path in self.refresh_repo_paths()
+        }
+
+
+def _handle_repo_in_subprocess(
+    configfile_path: str,
+    datadir_path: str,
+    jobs: int,
+    repodir_path: str,
+    print_flag: str,
+    full_rescan: bool,
+) -> tuple:
+    """
+    Entry point for the worker processes of `Core.handle_all_repos` (must be picklable).
+
+    :return:    (changed_files, summary of the metrics, failed sources of the repo)
+    """
+    c = Core(configfile_path, datadir_path, jobs=jobs)
+    changed_files = c.handle_repo(repodir_path, print_flag, full_rescan)
+    return changed_files, c.metrics.summary(), c.failed_sources.get(repodir_path, {})
+
+
+def stream_to_tmp_file(res: requests.Response, task: FetchTask) -> tuple:
+    """
+    Write the body of a streamed response chunk by chunk into a temporary file (inside
+    `task.target_dir`) and calculate its hash on the fly. Thus, the memory consumption is bounded
+    by the chunk size.
+
+    :return:    (tmp_path, size, sha256_hexdigest)
+    """
+
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{task.sdict['name']}.", suffix=TMPFILE_SUFFIX, dir=task.target_dir
+    )
+
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as binfile:
+            for chunk in res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if task.max_size is not None and size > task.max_size:
+                    raise ValueError(
+                        f"content of url {task.url} exceeds the maximum size ({task.max_size})"
+                    )
+                h.update(chunk)
+                binfile.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    return tmp_path, size, h.hexdigest()
+
+
+def write_tmp_file(content: bytes, task: FetchTask) -> tuple:
+    """
+    Write content which was not streamed (e.g. reconstructed from changesets) into a temporary
+    file (like `stream_to_tmp_file`).
+
+    :return:    (tmp_path, size, sha256_hexdigest)
+    """
+
+    if task.max_size is not None and len(content) > task.max_size:
+        raise ValueError(f"content of url {task.url} exceeds the maximum size ({task.max_size})")
+
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{task.sdict['name']}.", suffix=TMPFILE_SUFFIX, dir=task.target_dir
+    )
+    with os.fdopen(fd, "wb") as binfile:
+        binfile.write(content)
+
+    return tmp_path, len(content), hashlib.sha256(content).hexdigest()
+
+
+def copy_to_tmp_file(path: str, task: FetchTask) -> str:
+    """
+    Copy a downloaded file for a further task with the same url (see `fetch_unique_sources`).
+
+    :return:    path of the temporary file (inside `task.target_dir`)
+    """
+
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{task.sdict['name']}.", suffix=TMPFILE_SUFFIX, dir=task.target_dir
+    )
+    os.close(fd)
+    shutil.copyfile(path, tmp_path)
+    return tmp_path
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a url for the comparison of sources: scheme and host are case-insensitive, the
+    default port and the fragment are irrelevant for the request.
+    """
+
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+
+    # user information (if any) is case-sensitive
+    userinfo, _, host = parts.netloc.rpartition("@")
+    host = host.lower()
+    default_port = {"http": ":80", "https": ":443"}.get(scheme)
+    if default_port and host.endswith(default_port):
+        host = host[: -len(default_port)]
+    netloc = f"{userinfo}@{host}" if userinfo else host
+
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+def load_changeset_cache(path: str) -> dict:
+    """
+    :return:    dict like {"revision": int, "text": str} or None (no usable cache)
+    """
+    try:
+        with open(path, "r", encoding="utf8") as jsonfile:
+            cache = json.load(jsonfile)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logger.warning(f"could not parse {path} -> ignore it")
+        return None
+
+    if not isinstance(cache, dict) or not {"revision", "text"} <= set(cache):
+        return None
+    return cache
+
+
+def save_changeset_cache(path: str, revision: int, text: str):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf8") as jsonfile:
+        json.dump({"revision": revision, "text": text}, jsonfile)
+    os.replace(tmp_path, path)
+
+
+def remove_stale_tmp_files(dirpath: str):
+    """
+    Remove temporary files which were left by an interrupted run.
+    """
+
+    for name in os.listdir(dirpath):
+        if name.endswith(TMPFILE_SUFFIX):
+            os.remove(os.path.join(dirpath, name))
+
+
+def get_content_path(sdict: dict, layout: str) -> str:
+    """
+    Return the path of the file of a source relative to the data directory:
+
+    - "flat": `<name>`
+    - "hash": `<first digits of sha1(name)>/<name>`
+    - "host": `<hostname of the url>/<name>`
+    """
+
+    name = sdict["name"]
+    if layout == "flat":
+        return name
+    elif layout == "hash":
+        shard = hashlib.sha1(name.encode("utf8")).hexdigest()[:HASH_SHARD_LENGTH]
+        return f"{shard}/{name}"
+    elif layout == "host":
+        hostname = urlparse(sdict["url"]).hostname or "unknown-host"
+        return f"{hostname}/{name}"
+    else:
+        raise ValueError(f"unknown content_layout: {layout} (possible: {CONTENT_LAYOUTS})")
+
 
 def get_padname_from_url(url, append=".txt") -> str:
     if not url.startswith("http"):
@@ -441,6 +2003,36 @@ def _check_config_file(configfile_path, print_flag=True):
         logger.info(f'{u.bgreen("✓")} config file check passed: {configfile_path}')
 
 
+def ensure_exclude_patterns(repo: git.Repo, patterns: tuple) -> List[str]:
+    """
+    Add the patterns which are missing in the file `info/exclude` of the repo (local ignore rules
+    which are not part of the history, i.e. no commit is necessary).
+
+    :return:    list of added patterns
+    """
+
+    exclude_path = os.path.join(repo.git_dir, "info", "exclude")
+    try:
+        with open(exclude_path, "r", encoding="utf8") as txtfile:
+            content = txtfile.read()
+    except FileNotFoundError:
+        content = ""
+
+    existing_patterns = {line.strip() for line in content.splitlines()}
+    missing_patterns = [pattern for pattern in patterns if pattern not in existing_patterns]
+    if not missing_patterns:
+        return []
+
+    os.makedirs(os.path.dirname(exclude_path), exist_ok=True)
+    with open(exclude_path, "a", encoding="utf8") as txtfile:
+        if content and not content.endswith("\n"):
+            txtfile.write("\n")
+        txtfile.write(f"# internal files of {APPNAME}\n")
+        txtfile.write("".join(f"{pattern}\n" for pattern in missing_patterns))
+
+    return missing_patterns
+
+
 def _check_archive_repo(repodir_path: str) -> bool:
     """
     Check if provided archive repo has the expected structure
@@ -490,11 +2082,169 @@ def resolve_path_arg(path: str, type_: str) -> str:
 
 def load_config(configfile_path):
     with open(configfile_path, "r") as txtfile:
-        config_dict = yaml.safe_load(txtfile)
+        config_dict = yaml_safe_load(txtfile)
 
     return config_dict
 
 
+def yaml_safe_load(stream):
+    """
+    Like `yaml.safe_load` but use the fast libyaml-based loader if it is available.
+    """
+    loader = getattr(yaml, "CSafeLoader", None) or yaml.SafeLoader
+    return yaml.load(stream, Loader=loader)
+
+
+def load_sources_cache(cache_path: str) -> dict:
+    try:
+        with open(cache_path, "r", encoding="utf8") as jsonfile:
+            cache = json.load(jsonfile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+
+    if cache.get("version") != SOURCES_CACHE_VERSION:
+        cache = {"version": SOURCES_CACHE_VERSION, "files": {}}
+
+    return cache
+
+
+def save_sources_cache(cache_path: str, cache: dict):
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w", encoding="utf8") as jsonfile:
+        json.dump(cache, jsonfile)
+    os.replace(tmp_path, cache_path)
+
+
+def resolve_manifest(manifest_path: str, cache: dict, include_stack: tuple = ()) -> list:
+    """
+    Return the list of source dicts of a manifest file (recursively resolve includes).
+
+    :param manifest_path:   absolute path of the manifest file
+    :param cache:           dict (see `load_sources_cache`); will be updated if necessary
+    :param include_stack:   paths of the including manifests (to detect cycles)
+    """
+
+    if manifest_path in include_stack:
+        chain = " -> ".join(include_stack + (manifest_path,))
+        raise ValueError(f"cyclic include of sources files: {chain}")
+
+    sources = []
+    for entry in get_manifest_entries(manifest_path, cache):
+        if "include" in entry:
+            include_path = os.path.join(os.path.dirname(manifest_path), entry["include"])
+            include_path = os.path.abspath(include_path)
+            if not os.path.isfile(include_path):
+                raise FileNotFoundError(f"{include_path} (included by {manifest_path})")
+            sources.extend(resolve_manifest(include_path, cache, include_stack + (manifest_path,)))
+        else:
+            sources.append(entry["source"])
+
+    return sources
+
+
+def get_manifest_entries(manifest_path: str, cache: dict) -> list:
+    """
+    Return the normalized entries of one manifest file (without resolving includes). The result
+    is taken from the cache if the file did not change (same size and mtime or same content hash).
+    """
+
+    stat_result = os.stat(manifest_path)
+    cached = cache["files"].get(manifest_path)
+
+    if cached and (cached["size"], cached["mtime_ns"]) == (
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+    ):
+        return cached["entries"]
+
+    with open(manifest_path, "rb") as binfile:
+        raw_content = binfile.read()
+    digest = hashlib.sha256(raw_content).hexdigest()
+
+    if cached and cached["sha256"] == digest:
+        entries = cached["entries"]
+    else:
+        entries = parse_manifest(raw_content, manifest_path)
+
+    cache["files"][manifest_path] = {
+        "size": stat_result.st_size,
+        "mtime_ns": stat_result.st_mtime_ns,
+        "sha256": digest,
+        "entries": entries,
+    }
+    cache["modified"] = True
+
+    return entries
+
+
+def parse_manifest(raw_content: bytes, manifest_path: str) -> list:
+    """
+    Parse and validate the content of a manifest file.
+
+    :return:    list of dicts like {"source": source_dict} or {"include": relative_path}
+    """
+
+    raw_sources = yaml_safe_load(raw_content)
+
+    if raw_sources is None:
+        # empty file
+        return []
+    if not isinstance(raw_sources, list):
+        raise TypeError(f"{manifest_path}: top level element must be a list")
+
+    entries = []
+    for idx, s in enumerate(raw_sources):
+        if isinstance(s, str):
+            d = {
+                "name": get_padname_from_url(s),
+                "url": s,
+            }
+            entries.append({"source": d})
+        elif isinstance(s, dict):
+            if len(s) != 1:
+                raise ValueError(f"{manifest_path}, entry {idx}: expected exactly one key")
+            url, value_obj = list(s.items())[0]
+
+            if url == "include":
+                if not isinstance(value_obj, str):
+                    raise TypeError(f"{manifest_path}, entry {idx}: include path must be a string")
+                entries.append({"include": value_obj})
+                continue
+
+            # assume that there is an inner dict
+            if not isinstance(value_obj, dict):
+                raise TypeError(f"{manifest_path}, entry {idx}: expected a dict for {url}")
+            if not "name" in value_obj:
+                value_obj["name"] = get_padname_from_url(url)
+            value_obj["url"] = url
+
+            entries.append({"source": value_obj})
+        else:
+            raise TypeError(f"{manifest_path}, entry {idx}: unexpexted:{type(s)}")
+
+    return entries
+
+
+def check_sources(sources: list):
+    """
+    Detect name collisions (several sources would be written to the same file) and duplicate urls
+    via an index.
+    """
+
+    names = {}
+    urls = {}
+    for sdict in sources:
+        name, url = sdict["name"], sdict["url"]
+        if name in names:
+            msg = f"name collision: {name} is used for {names[name]} and {url}"
+            raise ValueError(msg)
+        names[name] = url
+
+        if url in urls:
+            logger.warning(f"duplicate url {url} (files: {urls[url]}, {name})")
+        urls[url] = name
+
+
 def bootstrap_config(configfile_path=None, datadir_path=None):
     """
     Try to load configfile. If it does not exist: create. Anyway: check
@@ -572,14 +2322,56 @@ def print_config(configfile_path=None, datadir_path=None):
     c.print_config()
 
 
-def update_all_repos(configfile_path=None, datadir_path=None, **kwargs):
-    c = Core(configfile_path, datadir_path)
+def update_all_repos(
+    configfile_path=None, datadir_path=None, jobs=None, metrics_paths=(None, None), **kwargs
+):
+    """
+    :param metrics_paths:   tuple (json_path, prometheus_path) (see `Core.export_metrics`)
+
+    :return:    dict like {repodir_path: failed_sources} (only repos with failed sources)
+    """
+    c = Core(configfile_path, datadir_path, jobs=jobs)
     c.handle_all_repos(**kwargs)
+    c.export_metrics(*metrics_paths)
+    return {path: failed for path, failed in c.failed_sources.items() if failed}
+
+
+def update_repo(
+    reponame,
+    configfile_path=None,
+    datadir_path=None,
+    jobs=None,
+    metrics_paths=(None, None),
+    **kwargs,
+):
+    """
+    :return:    dict like {source name: error message} of the failed sources
+    """
+    c = Core(configfile_path, datadir_path, jobs=jobs)
+    repodir_path = os.path.join(c.datadir_path, reponame)
+    c.handle_repo(repodir_path, **kwargs)
+    c.export_metrics(*metrics_paths)
+    return c.failed_sources.get(repodir_path, {})
+
+
+def rescan_repos(configfile_path=None, datadir_path=None):
+    c = Core(configfile_path, datadir_path)
+    repos = c.find_repos()
+
+    repo_str = "\n  - ".join(repos)
+    logger.info(f"The following repos where found:\n  - {repo_str}\n")
+
+    return repos
+
+
+def migrate_content_layout(reponame, layout, configfile_path=None, datadir_path=None):
+    c = Core(configfile_path, datadir_path)
+    c.migrate_content_layout(os.path.join(c.datadir_path, reponame), layout)
 
 
-def update_repo(reponame, configfile_path=None, datadir_path=None, **kwargs):
+def maintain_repos(configfile_path=None, datadir_path=None, **kwargs):
     c = Core(configfile_path, datadir_path)
-    c.handle_repo(os.path.join(c.datadir_path, reponame), **kwargs)
+    c.maintain_all_repos(**kwargs)
 
 
 def err_not_bootstrapped_stage1(path):
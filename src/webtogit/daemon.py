@@ -0,0 +1,176 @@
+"""
+Long-running mode (`webtogit --daemon`): the Core instance (configuration, http sessions) and the
+parsed sources are kept in memory. Every source is fetched on its own cadence (key `interval` of
+the source, default: setting `default_interval`; adapted automatically if `adaptive_polling` is
+activated). Sources which are due at roughly the same time are fetched together and committed
+in one batch per repo.
+"""
+
+import os
+import heapq
+import itertools
+import signal
+import threading
+import time
+
+from .core import Core, APPNAME, logger
+from . import util as u
+
+# sources which are due within this time span (in seconds) are handled in the same batch
+DEFAULT_BATCH_WINDOW = 60
+
+# time span (in seconds) after which the repos and the sources files are checked for changes
+DEFAULT_RESCAN_INTERVAL = 300
+
+
+class Daemon:
+    """
+    Scheduler which keeps a priority queue of (due_time, repo, source name)
+    """
+
+    def __init__(self, core: Core, print_flag: str = True):
+        self.core = core
+        self.print_flag = print_flag
+
+        config = core.config
+        self.batch_window = u.parse_interval(
+            config.get("daemon_batch_window", DEFAULT_BATCH_WINDOW)
+        )
+        self.rescan_interval = u.parse_interval(
+            config.get("daemon_rescan_interval", DEFAULT_RESCAN_INTERVAL)
+        )
+
+        # {repodir_path: {name: source_dict}}
+        self.sources = {}
+        self._last_rescan = None
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._stop_event = threading.Event()
+
+    def get_interval(self, repodir_path: str, sdict: dict) -> float:
+        # this takes adaptive polling into account (if activated)
+        return self.core.get_poll_interval(repodir_path, sdict)
+
+    def schedule(self, due_time: float, repodir_path: str, name: str):
+        heapq.heappush(self._queue, (due_time, next(self._counter), repodir_path, name))
+
+    @property
+    def next_due_time(self):
+        if not self._queue:
+            return None
+        return self._queue[0][0]
+
+    def refresh_sources(self, now: float):
+        """
+        (Re-)load the sources of all repos (this is cheap because the parsed sources files are
+        cached, see `Core.load_webdoc_sources`). New sources are due immediately. Removed sources
+        are dropped when they become due. If the sources of a repo cannot be loaded (e.g. invalid
+        YAML), the previously loaded sources of that repo are kept.
+        """
+
+        self._last_rescan = now
+        try:
+            repodir_paths = self.core.refresh_repo_paths()
+        except Exception as err:
+            logger.error(f'{u.bred("Error:")} could not refresh the repos: {err}')
+            return
+
+        for repodir_path in repodir_paths:
+            try:
+                sources = self.core.load_webdoc_sources(repodir_path)
+            except FileNotFoundError:
+                continue
+            except Exception as err:
+                msg = f"could not load the sources of {repodir_path} (keeping the old ones): {err}"
+                logger.error(f'{u.bred("Error:")} {msg}')
+                continue
+
+            old_sources = self.sources.get(repodir_path, {})
+            new_sources = {}
+            for sdict in sources:
+                new_sources[sdict["name"]] = sdict
+                if sdict["name"] not in old_sources:
+                    self.schedule(now, repodir_path, sdict["name"])
+
+            self.sources[repodir_path] = new_sources
+
+    def run_once(self, now: float = None) -> dict:
+        """
+        Fetch and commit all sources which are due (within the batch window).
+
+        :return:    dict like {repodir_path: changed_files}
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        if self._last_rescan is None or now - self._last_rescan >= self.rescan_interval:
+            self.refresh_sources(now)
+
+        # {repodir_path: {name: source_dict}}
+        due_sources = {}
+        while self._queue and self._queue[0][0] <= now + self.batch_window:
+            _, _, repodir_path, name = heapq.heappop(self._queue)
+            sdict = self.sources.get(repodir_path, {}).get(name)
+            if sdict is None:
+                # the source was removed from the sources file
+                continue
+            due_sources.setdefault(repodir_path, {})[name] = sdict
+
+        if not due_sources:
+            return {}
+
+        sources_dict = {path: list(sdicts.values()) for path, sdicts in due_sources.items()}
+
+        # the metrics (if configured) describe the last batch
+        self.core.metrics.reset()
+        try:
+            res = self.core.handle_sources(sources_dict, print_flag=self.print_flag)
+            self.core.export_metrics()
+        except Exception as err:
+            logger.error(f'{u.bred("Error:")} {type(err).__name__}: {err}')
+            res = {}
+
+        for repodir_path, sdicts in due_sources.items():
+            for name, sdict in sdicts.items():
+                self.schedule(now + self.get_interval(repodir_path, sdict), repodir_path, name)
+
+        return res
+
+    def run(self, max_cycles: int = None):
+        """
+        Main loop (until `stop()` is called or `max_cycles` is reached).
+        """
+        cycles = 0
+        while not self._stop_event.is_set():
+            self.run_once()
+            cycles += 1
+            if max_cycles is not None and cycles >= max_cycles:
+                break
+
+            now = time.monotonic()
+            timeout = self._last_rescan + self.rescan_interval - now
+            if self.next_due_time is not None:
+                timeout = min(timeout, self.next_due_time - now)
+
+            # sleep (interruptible by `stop()`)
+            self._stop_event.wait(max(timeout, 0))
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def run_daemon(configfile_path=None, datadir_path=None, jobs=None, print_flag=True):
+    c = Core(configfile_path, datadir_path, jobs=jobs)
+    daemon = Daemon(c, print_flag=print_flag)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    logger.info(f"{APPNAME} daemon started (pid: {os.getpid()})")
+
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+
+    logger.info(f"{APPNAME} daemon stopped")
@@ -0,0 +1,120 @@
+"""
+Normalization filters for the content of sources: volatile parts (timestamps, session tokens,
+counters, ...) are removed before the content is stored. Thus, a source whose relevant content did
+not change produces no write and no commit.
+
+Filters are specified as list of dicts (in the sources file or in the settings), e.g.:
+
+    - regex: 'name="csrf_token" value="[^"]*"'
+      replace: 'name="csrf_token" value=""'
+    - drop_lines: "^Last edited"
+    - json_remove_keys: [timestamp, views]
+"""
+
+import hashlib
+import json
+import logging
+import re
+
+from .release import APPNAME
+
+logger = logging.getLogger(APPNAME)
+
+FILTER_TYPES = ("regex", "drop_lines", "json_remove_keys")
+
+
+def compile_filters(specs: list) -> list:
+    """
+    Convert the filter specifications to functions (str -> str). Invalid specifications raise
+    a ValueError (i.e. configuration errors are detected before anything is downloaded).
+    """
+
+    if not specs:
+        return []
+    if not isinstance(specs, list):
+        raise ValueError(f"filters must be a list (got {type(specs).__name__})")
+
+    return [compile_filter(spec) for spec in specs]
+
+
+def compile_filter(spec: dict):
+    if not isinstance(spec, dict):
+        raise ValueError(f"invalid filter: {spec!r} (expected a dict)")
+
+    filter_types = [key for key in FILTER_TYPES if key in spec]
+    if len(filter_types) != 1:
+        raise ValueError(f"invalid filter: {spec!r} (expected exactly one of {FILTER_TYPES})")
+    filter_type = filter_types[0]
+
+    if filter_type == "regex":
+        regex = compile_regex(spec["regex"])
+        replacement = spec.get("replace", "")
+        return lambda text: regex.sub(replacement, text)
+
+    elif filter_type == "drop_lines":
+        regex = compile_regex(spec["drop_lines"])
+        return lambda text: "".join(
+            line for line in text.splitlines(keepends=True) if not regex.search(line)
+        )
+
+    else:
+        keys = spec["json_remove_keys"]
+        if isinstance(keys, str):
+            keys = [keys]
+        return lambda text: remove_json_keys(text, set(keys))
+
+
+def compile_regex(pattern: str):
+    try:
+        return re.compile(pattern)
+    except (re.error, TypeError) as err:
+        raise ValueError(f"invalid regular expression in filter: {pattern!r} ({err})")
+
+
+def remove_json_keys(text: str, keys: set) -> str:
+    """
+    Remove the given keys (at any depth) from a JSON document. The result is serialized with
+    indentation (which also makes the diffs of the repo more readable).
+    """
+
+    try:
+        data = json.loads(text)
+    except ValueError:
+        logger.warning("json_remove_keys: content is not valid JSON -> leave it unchanged")
+        return text
+
+    def remove(obj):
+        if isinstance(obj, dict):
+            return {key: remove(value) for key, value in obj.items() if key not in keys}
+        elif isinstance(obj, list):
+            return [remove(value) for value in obj]
+        return obj
+
+    return json.dumps(remove(data), indent=2, ensure_ascii=False) + "\n"
+
+
+def apply_filters(content: bytes, filters: list) -> bytes:
+    """
+    Apply the (compiled) filters to the content. Content which is not valid UTF-8 is passed
+    through unchanged where the filters do not match.
+    """
+
+    text = content.decode("utf8", errors="surrogateescape")
+    for filter_func in filters:
+        text = filter_func(text)
+    return text.encode("utf8", errors="surrogateescape")
+
+
+def filter_file(path: str, filters: list) -> tuple:
+    """
+    Apply the filters to the file at `path` (in place).
+
+    :return:    (size, sha256_hexdigest) of the normalized content
+    """
+
+    with open(path, "rb") as binfile:
+        content = apply_filters(binfile.read(), filters)
+    with open(path, "wb") as binfile:
+        binfile.write(content)
+
+    return len(content), hashlib.sha256(content).hexdigest()
@@ -0,0 +1,225 @@
+"""
+Timing instrumentation of a run: accumulated durations of the phases (config load, repo discovery,
+parsing of the sources files, fetching, writing, git operations) and one record per request.
+The data can be exported as JSON summary and as file for the textfile collector of the
+Prometheus node exporter.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+METRICS_PREFIX = "webtogit"
+
+
+class RunMetrics:
+    """
+    Collect the timings of one run (thread-safe because the downloads run in worker threads).
+    """
+
+    # objects with the methods `phase_started(name)` and `phase_finished(name)` which are notified
+    # by every instance (used by the profiling mode, see `profiling.Profiler`)
+    phase_listeners = []
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.start_time = time.time()
+            self._start_counter = time.perf_counter()
+
+            # {phase: accumulated duration in seconds}
+            self.phases = {}
+
+            # one dict per http request (see `record_request`)
+            self.requests = []
+
+            # {repodir_path: {"duration": ..., "changed_files": ..., "failed_sources": ...}}
+            self.repos = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Context manager which adds the duration of the block to the phase `name`.
+        """
+        for listener in self.phase_listeners:
+            listener.phase_started(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_duration(name, time.perf_counter() - start)
+            for listener in self.phase_listeners:
+                listener.phase_finished(name)
+
+    def add_duration(self, name: str, duration: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def record_request(
+        self,
+        url: str,
+        repo_dir: str,
+        status_code: int = None,
+        ttfb: float = None,
+        transfer: float = None,
+        size: int = 0,
+        error: str = None,
+    ):
+        """
+        :param ttfb:        time to first byte: from sending the request until the response
+                            headers were received (includes connection setup if necessary)
+        :param transfer:    time for reading the body
+        :param size:        number of bytes of the body
+        """
+        entry = {
+            "url": url,
+            "host": urlparse(url).netloc,
+            "repo": os.path.basename(repo_dir),
+            "status_code": status_code,
+            "ttfb": ttfb,
+            "transfer": transfer,
+            "bytes": size,
+            "error": error,
+        }
+        with self._lock:
+            self.requests.append(entry)
+
+    def record_repo(self, repodir_path: str, duration: float, changed_files: int, failed: int):
+        with self._lock:
+            self.repos[repodir_path] = {
+                "duration": duration,
+                "changed_files": changed_files,
+                "failed_sources": failed,
+            }
+
+    def merge(self, summary: dict):
+        """
+        Add the data of another run (e.g. of a worker process, see `summary`) to this one. The
+        durations of the phases are added up.
+        """
+        with self._lock:
+            for name, duration in summary["phases"].items():
+                self.phases[name] = self.phases.get(name, 0.0) + duration
+            self.requests.extend(summary["requests"])
+            self.repos.update(summary["repos"])
+
+    def get_host_stats(self) -> dict:
+        """
+        :return:    dict like {host: {"requests", "errors", "bytes", "ttfb_sum", "ttfb_max",
+                    "transfer_sum"}}
+        """
+        hosts = {}
+        with self._lock:
+            for entry in self.requests:
+                stats = hosts.setdefault(
+                    entry["host"],
+                    dict(
+                        requests=0, errors=0, bytes=0, ttfb_sum=0.0, ttfb_max=0.0, transfer_sum=0.0
+                    ),
+                )
+                stats["requests"] += 1
+                if entry["error"] is not None:
+                    stats["errors"] += 1
+                stats["bytes"] += entry["bytes"] or 0
+                stats["ttfb_sum"] += entry["ttfb"] or 0
+                stats["ttfb_max"] = max(stats["ttfb_max"], entry["ttfb"] or 0)
+                stats["transfer_sum"] += entry["transfer"] or 0
+        return hosts
+
+    def summary(self) -> dict:
+        with self._lock:
+            summary = {
+                "start_time": self.start_time,
+                "duration": time.perf_counter() - self._start_counter,
+                "phases": dict(self.phases),
+                "repos": dict(self.repos),
+                "requests": list(self.requests),
+            }
+        summary["hosts"] = self.get_host_stats()
+        return summary
+
+    def write_json(self, path: str):
+        write_atomically(path, json.dumps(self.summary(), indent=1, sort_keys=True))
+
+    def write_prometheus(self, path: str):
+        """
+        Write the metrics in the text format of Prometheus (for the textfile collector of the
+        node exporter the file name must end with `.prom`).
+        """
+        write_atomically(path, format_prometheus(self.summary()))
+
+
+def format_prometheus(summary: dict) -> str:
+
+    lines = []
+
+    def add_metric(name, metric_type, help_text, samples):
+        name = f"{METRICS_PREFIX}_{name}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_str = ",".join(f'{key}="{escape_label_value(val)}"' for key, val in labels)
+            label_str = f"{{{label_str}}}" if label_str else ""
+            lines.append(f"{name}{label_str} {value}")
+
+    add_metric(
+        "last_run_timestamp_seconds",
+        "gauge",
+        "Start time of the last run.",
+        [((), summary["start_time"])],
+    )
+    add_metric(
+        "last_run_duration_seconds",
+        "gauge",
+        "Duration of the last run.",
+        [((), summary["duration"])],
+    )
+    add_metric(
+        "phase_duration_seconds",
+        "gauge",
+        "Accumulated duration of each phase of the last run.",
+        [((("phase", phase),), value) for phase, value in sorted(summary["phases"].items())],
+    )
+
+    hosts = sorted(summary["hosts"].items())
+    for key, help_text in (
+        ("requests", "Number of http requests per host in the last run."),
+        ("errors", "Number of failed http requests per host in the last run."),
+        ("bytes", "Number of downloaded bytes per host in the last run."),
+        ("ttfb_sum", "Sum of the times to first byte (seconds) per host."),
+        ("ttfb_max", "Maximum time to first byte (seconds) per host."),
+        ("transfer_sum", "Sum of the transfer times (seconds) per host."),
+    ):
+        samples = [((("host", host),), stats[key]) for host, stats in hosts]
+        add_metric(f"host_{key}", "gauge", help_text, samples)
+
+    repos = sorted(summary["repos"].items())
+    for key, help_text in (
+        ("duration", "Duration of writing and committing the files of the repo (seconds)."),
+        ("changed_files", "Number of changed files in the last run."),
+        ("failed_sources", "Number of sources which could not be downloaded in the last run."),
+    ):
+        samples = [((("repo", os.path.basename(path)),), stats[key]) for path, stats in repos]
+        add_metric(f"repo_{key}", "gauge", help_text, samples)
+
+    return "\n".join(lines) + "\n"
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def write_atomically(path: str, content: str):
+    """
+    Write to a temporary file first (scrapers and other readers never see a half-written file).
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf8") as txtfile:
+        txtfile.write(content)
+    os.replace(tmp_path, path)
@@ -0,0 +1,189 @@
+"""
+Profiling mode of the command line interface (`--profile`): run a command under cProfile and
+tracemalloc, write the pstats file and a report of the top allocations per phase and print the
+peak memory.
+"""
+
+import cProfile
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+from .metrics import RunMetrics
+from .release import APPNAME
+
+logger = logging.getLogger(APPNAME)
+
+DEFAULT_TOP_N = 15
+
+# the timing phases (see `metrics.RunMetrics.phase`) grouped by the corresponding step of a run
+PHASE_GROUPS = {
+    "load_webdoc_sources": ("parse_sources",),
+    "download_source_contents": ("prepare", "fetch", "write"),
+    "make_commit": ("git_add", "git_diff", "git_commit"),
+}
+
+# allocations of the profiler itself are not interesting
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def get_phase_group(phase: str) -> str:
+    for group, phases in PHASE_GROUPS.items():
+        if phase in phases:
+            return group
+    return phase
+
+
+class Profiler:
+    """
+    Context manager which profiles the enclosed block.
+
+    Note: cProfile only sees the calling thread (allocations of other threads are traced
+    nevertheless) and the worker processes of `--parallel-repos` are not profiled at all.
+    """
+
+    def __init__(self, output_dir: str = None, top_n: int = DEFAULT_TOP_N, print_flag=True):
+        if output_dir is None:
+            output_dir = os.getcwd()
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        self.output_prefix = os.path.join(output_dir, f"{APPNAME}-profile-{timestamp}")
+        self.pstats_path = f"{self.output_prefix}.pstats"
+        self.report_path = f"{self.output_prefix}-alloc.txt"
+        self.top_n = top_n
+        self.print_flag = print_flag
+
+        self.profile = None
+
+        # {(thread id, phase): snapshot at the start of the phase}
+        self._start_snapshots = {}
+        self._lock = threading.Lock()
+
+        # {group: {"phases": set, "calls": int, "allocations": {location: [size, count]}}}
+        self.phase_allocations = {}
+        self.peak_memory = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.output_prefix), exist_ok=True)
+        tracemalloc.start()
+        RunMetrics.phase_listeners.append(self)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the report is also written if the command failed (or called `exit()`)
+        self.profile.disable()
+        RunMetrics.phase_listeners.remove(self)
+        self.peak_memory = tracemalloc.get_traced_memory()[1]
+        final_snapshot = self._take_snapshot()
+        tracemalloc.stop()
+
+        self.profile.dump_stats(self.pstats_path)
+        with open(self.report_path, "w", encoding="utf8") as txtfile:
+            txtfile.write(self.format_report(final_snapshot))
+
+        if self.print_flag:
+            logger.info(
+                f"profile written to {self.pstats_path} (view with `python -m pstats <file>`)"
+            )
+            logger.info(f"allocation report written to {self.report_path}")
+            logger.info(f"peak memory (traced): {format_size(self.peak_memory)}")
+            max_rss = get_max_rss()
+            if max_rss is not None:
+                logger.info(f"peak memory (RSS): {format_size(max_rss)}")
+
+        return False
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def phase_started(self, name: str):
+        snapshot = self._take_snapshot()
+        with self._lock:
+            self._start_snapshots[(threading.get_ident(), name)] = snapshot
+
+    def phase_finished(self, name: str):
+        with self._lock:
+            start_snapshot = self._start_snapshots.pop((threading.get_ident(), name), None)
+        if start_snapshot is None:
+            return
+
+        diff = self._take_snapshot().compare_to(start_snapshot, "lineno")
+        group = get_phase_group(name)
+        with self._lock:
+            data = self.phase_allocations.setdefault(
+                group, {"phases": set(), "calls": 0, "allocations": {}}
+            )
+            data["phases"].add(name)
+            data["calls"] += 1
+            for stat in diff:
+                if not stat.size_diff and not stat.count_diff:
+                    continue
+                location = str(stat.traceback)
+                values = data["allocations"].setdefault(location, [0, 0])
+                values[0] += stat.size_diff
+                values[1] += stat.count_diff
+
+    def format_report(self, final_snapshot) -> str:
+        lines = [
+            f"{APPNAME} allocation report",
+            "",
+            f"peak memory (traced): {format_size(self.peak_memory)}",
+            "",
+            f"top {self.top_n} allocations (net growth of memory) per phase:",
+        ]
+
+        # the main groups first (in the order of a run), then the others
+        groups = [group for group in PHASE_GROUPS if group in self.phase_allocations]
+        groups += sorted(set(self.phase_allocations) - set(groups))
+        for group in groups:
+            data = self.phase_allocations[group]
+            phases = ", ".join(sorted(data["phases"]))
+            lines.extend(["", f"== {group} (phases: {phases}; {data['calls']} calls) =="])
+            allocations = sorted(
+                data["allocations"].items(), key=lambda item: abs(item[1][0]), reverse=True
+            )
+            for location, (size, count) in allocations[: self.top_n]:
+                lines.append(
+                    f"  {format_size(size, sign=True):>14} {count:+9d} blocks  {location}"
+                )
+
+        lines.extend(["", f"== memory still allocated at the end (top {self.top_n}) =="])
+        for stat in final_snapshot.statistics("lineno")[: self.top_n]:
+            lines.append(
+                f"  {format_size(stat.size):>14} {stat.count:9d} blocks  {stat.traceback}"
+            )
+
+        return "\n".join(lines) + "\n"
+
+
+def format_size(size: int, sign=False) -> str:
+    prefix = ("+" if size >= 0 else "-") if sign else ""
+    size = abs(size)
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{prefix}{size:.1f} {unit}"
+        size /= 1024
+    return f"{prefix}{size:.1f} GiB"
+
+
+def get_max_rss():
+    """
+    :return:    peak resident set size of the process in bytes (None if not available)
+    """
+    try:
+        import resource
+    except ImportError:
+        # e.g. on windows
+        return None
+
+    # KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
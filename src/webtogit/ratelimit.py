@@ -0,0 +1,104 @@
+"""
+Rate limiting for the fetch engine: one token bucket per host (which can additionally be paused,
+e.g. because of a `Retry-After` header) and helpers for retries with jittered backoff.
+"""
+
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from .util import LazyModule
+
+asyncio = LazyModule("asyncio")
+
+
+class TokenBucket:
+    """
+    Allow `rate` requests per second on average and bursts of up to `burst` requests.
+
+    The bucket is used by the coroutines of one event loop only, i.e. no lock is necessary.
+    """
+
+    def __init__(self, rate: float = None, burst: int = 1, clock=time.monotonic):
+        """
+        :param rate:    requests per second (None means: unlimited)
+        :param burst:   maximum number of requests which can be sent without waiting
+        :param clock:   function which returns the current time in seconds
+        """
+
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.clock = clock
+
+        self.tokens = self.capacity
+        self.updated = clock()
+
+        # no request is allowed before this time (see `pause`)
+        self.paused_until = 0
+
+    def reserve(self) -> float:
+        """
+        Take one token (the number of tokens might become negative, i.e. tokens are reserved in
+        advance).
+
+        :return:    waiting time (in seconds) until the token may be used
+        """
+        now = self.clock()
+        if not self.rate:
+            return max(0, self.paused_until - now)
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+
+        wait_time = max(0, -self.tokens / self.rate)
+        return max(wait_time, self.paused_until - now)
+
+    def pause(self, seconds: float):
+        """
+        Do not allow any request during the next `seconds` (e.g. because the server demanded it).
+        """
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    async def acquire(self):
+        await asyncio.sleep(self.reserve())
+
+        # the bucket might have been paused in the meantime
+        while self.clock() < self.paused_until:
+            await asyncio.sleep(self.paused_until - self.clock())
+
+
+def parse_retry_after(value: str, now: float = None) -> float:
+    """
+    Convert the value of a `Retry-After` header (seconds or HTTP-date) to seconds.
+
+    :return:    number of seconds (>= 0) or None if the value could not be parsed
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if now is None:
+        now = time.time()
+    return max(0.0, date.timestamp() - now)
+
+
+def get_backoff_delay(attempt: int, base: float, max_delay: float = None) -> float:
+    """
+    Exponential backoff with jitter: a random value between 50% and 100% of `base * 2**attempt`.
+    The jitter prevents many clients (or many sources) from retrying at the same moment.
+    """
+    delay = base * 2**attempt
+    if max_delay is not None:
+        delay = min(delay, max_delay)
+    return delay * random.uniform(0.5, 1)
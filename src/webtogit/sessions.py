@@ -0,0 +1,78 @@
+"""
+HTTP session handling: one pooled `requests.Session` per host which is reused for all sources
+(of all repos) during one run. This avoids repeated DNS lookups and TLS handshakes.
+"""
+
+from __future__ import annotations  # annotations like `requests.Session` must not trigger imports
+
+import threading
+from urllib.parse import urlparse
+
+from .release import __version__
+from .util import LazyModule
+
+requests = LazyModule("requests")
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_POOL_MAXSIZE = 4
+DEFAULT_HEADERS = {"User-Agent": f"webtogit/{__version__}"}
+
+
+class SessionManager:
+    """
+    Create (on demand) and cache one session per host
+    """
+
+    def __init__(self, timeout=None, pool_maxsize=None, headers=None):
+        """
+        :param timeout:         timeout for connecting and reading (in seconds)
+        :param pool_maxsize:    number of connections which are kept alive per host
+        :param headers:         dict of additional headers which are sent with every request
+        """
+
+        self.timeout = timeout or DEFAULT_TIMEOUT
+        self.pool_maxsize = pool_maxsize or DEFAULT_POOL_MAXSIZE
+        self.headers = {**DEFAULT_HEADERS, **(headers or {})}
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, url: str) -> requests.Session:
+
+        parsed_url = urlparse(url)
+        key = (parsed_url.scheme, parsed_url.netloc)
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._create_session()
+                self._sessions[key] = session
+
+        return session
+
+    def _create_session(self) -> requests.Session:
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        session.headers.update(self.headers)
+
+        # every session serves only one host -> one pool with `pool_maxsize` connections
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.get_session(url).get(url, **kwargs)
+
+    @property
+    def number_of_sessions(self):
+        return len(self._sessions)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
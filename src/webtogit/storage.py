@@ -0,0 +1,475 @@
+"""
+Storage of the downloaded contents inside a repo: the storage backends (working tree and index or
+directly the object database) and the journal which allows to resume an interrupted run.
+"""
+
+from __future__ import annotations  # annotations like `git.Repo` must not trigger imports
+
+import os
+import json
+import hashlib
+import mmap
+import shutil
+import subprocess
+from typing import List, TYPE_CHECKING
+
+from .release import APPNAME
+from .metrics import RunMetrics
+from .util import LazyModule
+
+if TYPE_CHECKING:
+    from .core import FetchTask, FetchResult
+
+git = LazyModule("git")
+
+# name of the directory inside the repo which contains the actual data
+REPO_DATA_DIR_NAME = "content"
+
+# name of the file (inside the repo dir) which records the progress of the current run
+JOURNAL_FILE_NAME = f".{APPNAME}-journal.jsonl"
+
+# files larger than this (in bytes) are hashed via mmap instead of chunked reading
+MMAP_THRESHOLD = 1024**2
+
+# maximum number of paths which are passed to one git command
+GIT_PATHS_CHUNK_SIZE = 1000
+
+
+class RunJournal:
+    """
+    Append-only record of the progress of one run of a repo (`JOURNAL_FILE_NAME`, ignored by
+    git). Every written file and every failed source is recorded immediately. The entries are
+    removed after the commit. If the journal contains a source at the beginning of the next run,
+    a previous run was interrupted: files which were already written are committed without
+    downloading them again.
+    """
+
+    def __init__(self, repo_dir: str):
+        self.path = os.path.join(repo_dir, JOURNAL_FILE_NAME)
+
+        # {source name: last "fetched" entry} of the interrupted run(s)
+        self.fetched = {}
+
+        # {source name: error message} of the current run
+        self.failed = {}
+
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf8") as txtfile:
+                lines = txtfile.readlines()
+        except FileNotFoundError:
+            return
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line might be incomplete (interruption while writing)
+                continue
+            if entry.get("event") == "fetched":
+                self.fetched[entry["name"]] = entry
+
+    def get_resume_entry(self, task: FetchTask) -> dict:
+        """
+        Return the entry of a file which was written by an interrupted run or None.
+        """
+        entry = self.fetched.get(task.sdict["name"])
+        if entry and entry["url"] == task.url and entry["path"] == task.content_path:
+            return entry
+        return None
+
+    def _append(self, entry: dict):
+        with open(self.path, "a", encoding="utf8") as txtfile:
+            txtfile.write(json.dumps(entry) + "\n")
+
+    def record_fetched(self, task: FetchTask, result: FetchResult):
+        entry = {
+            "event": "fetched",
+            "name": task.sdict["name"],
+            "url": task.url,
+            "path": task.content_path,
+            "sha256": result.sha256,
+            "etag": result.etag,
+            "last_modified": result.last_modified,
+        }
+        self.fetched[entry["name"]] = entry
+        self._append(entry)
+
+    def record_failed(self, task: FetchTask, error: str):
+        self.failed[task.sdict["name"]] = error
+        self._append({"event": "failed", "name": task.sdict["name"], "url": task.url})
+
+    def finish(self, names: List[str] = None):
+        """
+        Remove the entries of the given sources (default: all) after their commit. The entries of
+        other sources (e.g. not part of the current batch of the daemon) are kept until these
+        sources are committed. The journal is removed if no entries remain.
+        """
+        if names is None:
+            self.fetched.clear()
+        else:
+            for name in names:
+                self.fetched.pop(name, None)
+
+        if self.fetched:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf8") as txtfile:
+                txtfile.writelines(json.dumps(entry) + "\n" for entry in self.fetched.values())
+            os.replace(tmp_path, self.path)
+        elif os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+class WorktreeStorage:
+    """
+    Default storage backend: the sources are stored as files in the data directory of the repo
+    (working tree) and committed via the index.
+    """
+
+    name = "worktree"
+
+    def __init__(self, repo: git.Repo, metrics: RunMetrics = None):
+        self.repo = repo
+        self.paddir = os.path.join(repo.working_tree_dir, REPO_DATA_DIR_NAME)
+        self.metrics = metrics or RunMetrics()
+
+    def get_tmp_dir(self) -> str:
+        os.makedirs(self.paddir, exist_ok=True)
+        return self.paddir
+
+    def has_file(self, fname: str) -> bool:
+        return os.path.isfile(os.path.join(self.paddir, fname))
+
+    def store(self, fname: str, result: FetchResult, old_entry: dict) -> bool:
+        """
+        Move the downloaded file to its final place (if its content has changed).
+
+        :return:    True if the file was written
+        """
+        fpath = os.path.join(self.paddir, fname)
+
+        if file_has_content(fpath, result.size, result.sha256, old_entry):
+            os.remove(result.tmp_path)
+            return False
+
+        # atomic: there is never a half-written file in the working tree
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        os.replace(result.tmp_path, fpath)
+        return True
+
+    def get_file_info(self, fname: str) -> dict:
+        stat_result = os.stat(os.path.join(self.paddir, fname))
+        return {"size": stat_result.st_size, "mtime_ns": stat_result.st_mtime_ns}
+
+    def can_resume(self, fname: str, sha256: str) -> bool:
+        """
+        Return True if the file (written by an interrupted run) is still present and unchanged.
+        """
+        fpath = os.path.join(self.paddir, fname)
+        return os.path.isfile(fpath) and file_sha256(fpath) == sha256
+
+    def commit(self, changed_paths: List[str], message: str) -> List[str]:
+        r = self.repo
+
+        if changed_paths is None:
+            with self.metrics.phase("git_add"):
+                r.git.add(REPO_DATA_DIR_NAME)
+            with self.metrics.phase("git_diff"):
+                diff_objects = r.index.diff(r.head.commit)
+
+            changedFiles = [do.a_path for do in diff_objects]
+        else:
+            changedFiles = []
+            for chunk in chunks(changed_paths, GIT_PATHS_CHUNK_SIZE):
+                with self.metrics.phase("git_add"):
+                    r.git.add("--", *chunk)
+
+                # a written file might still be identical to HEAD (e.g. after a revert)
+                with self.metrics.phase("git_diff"):
+                    # -z: the paths are not quoted (e.g. non-ASCII characters)
+                    res = r.git.diff("--cached", "--name-only", "--no-renames", "-z", "--", *chunk)
+                changedFiles.extend(path for path in res.split("\0") if path)
+
+        if changedFiles:
+
+            with self.metrics.phase("git_commit"):
+                r.git.commit(message=message)
+
+        return changedFiles
+
+    def move(self, renames: dict, message: str) -> List[str]:
+        """
+        Move files (`renames`: {old_path: new_path}, relative to the data directory) via `git mv`
+        and commit. The content is unchanged, i.e. git detects the renames.
+
+        :return:    list of the new paths (relative to the repo)
+        """
+        r = self.repo
+
+        # `git mv src1 src2 ... dst_dir` keeps the base names -> group by destination directory
+        sources_by_dst_dir = {}
+        for old_path, new_path in renames.items():
+            assert os.path.basename(old_path) == os.path.basename(new_path)
+            dst_dir = os.path.dirname(os.path.join(REPO_DATA_DIR_NAME, new_path))
+            sources_by_dst_dir.setdefault(dst_dir, []).append(
+                os.path.join(REPO_DATA_DIR_NAME, old_path)
+            )
+
+        for dst_dir, src_paths in sources_by_dst_dir.items():
+            os.makedirs(os.path.join(r.working_tree_dir, dst_dir), exist_ok=True)
+            for chunk in chunks(src_paths, GIT_PATHS_CHUNK_SIZE):
+                r.git.mv("--", *chunk, dst_dir)
+
+        # remove subdirectories which became empty
+        for old_path in renames:
+            old_dir = os.path.dirname(os.path.join(self.paddir, old_path))
+            if old_dir != self.paddir and os.path.isdir(old_dir) and not os.listdir(old_dir):
+                os.rmdir(old_dir)
+
+        if renames:
+            r.git.commit(message=message)
+
+        return sorted(os.path.join(REPO_DATA_DIR_NAME, path) for path in renames.values())
+
+
+class ObjectStorage:
+    """
+    Storage backend which writes the sources directly into the object database of the repo
+    (one `git fast-import` process per commit). The data directory (working tree) is not used,
+    i.e. every snapshot is stored only once on disk. The index is reset to the new HEAD after
+    every commit (otherwise it would contain the tree of the previous commit).
+    """
+
+    name = "objects"
+
+    def __init__(self, repo: git.Repo, metrics: RunMetrics = None):
+        self.repo = repo
+        self.metrics = metrics or RunMetrics()
+
+        # {path relative to the repo: path of the downloaded temporary file}
+        self.pending = {}
+
+        self._head_blobs = None
+        self._head_blobs_commit = None
+
+    def get_tmp_dir(self) -> str:
+        tmp_dir = os.path.join(self.repo.git_dir, f"{APPNAME}-tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        return tmp_dir
+
+    @property
+    def head_blobs(self) -> dict:
+        """
+        {path: blob-sha} of the data directory in the HEAD commit
+        """
+        head_commit = self.repo.head.commit.hexsha
+        if self._head_blobs_commit != head_commit:
+            res = self.repo.git.ls_tree("-r", "-z", head_commit, "--", REPO_DATA_DIR_NAME)
+            blobs = {}
+            for entry in res.split("\0"):
+                if not entry:
+                    continue
+                meta, path = entry.split("\t", 1)
+                blobs[path] = meta.split()[2]
+            self._head_blobs = blobs
+            self._head_blobs_commit = head_commit
+
+        return self._head_blobs
+
+    @staticmethod
+    def _get_path(fname: str) -> str:
+        return f"{REPO_DATA_DIR_NAME}/{fname}"
+
+    def has_file(self, fname: str) -> bool:
+        return self._get_path(fname) in self.head_blobs
+
+    def store(self, fname: str, result: FetchResult, old_entry: dict) -> bool:
+        path = self._get_path(fname)
+
+        if git_blob_sha1(result.tmp_path) == self.head_blobs.get(path):
+            os.remove(result.tmp_path)
+            return False
+
+        old_tmp_path = self.pending.pop(path, None)
+        if old_tmp_path:
+            os.remove(old_tmp_path)
+        self.pending[path] = result.tmp_path
+        return True
+
+    def get_file_info(self, fname: str) -> dict:
+        return {}
+
+    def can_resume(self, fname: str, sha256: str) -> bool:
+        # the pending files of an interrupted run are removed (see `remove_stale_tmp_files`)
+        return False
+
+    def commit(self, changed_paths: List[str], message: str) -> List[str]:
+        """
+        Write all pending files as blobs together with the new tree and the commit via
+        `git fast-import`. The argument `changed_paths` is not needed because the pending files
+        are exactly the changes.
+        """
+
+        if not self.pending:
+            return []
+
+        try:
+            with self.metrics.phase("git_commit"):
+                proc = self._start_fast_import(message)
+                stream = proc.stdin
+
+                changed_files = sorted(self.pending)
+                for path in changed_files:
+                    tmp_path = self.pending[path]
+                    size = os.path.getsize(tmp_path)
+                    cmd = f"M 100644 inline {quote_fast_import_path(path)}\ndata {size}\n"
+                    stream.write(cmd.encode("utf8"))
+                    with open(tmp_path, "rb") as binfile:
+                        shutil.copyfileobj(binfile, stream)
+                    stream.write(b"\n")
+
+                self._finish_fast_import(proc)
+        finally:
+            # also after an error: the instance is reused by the next run (e.g. in daemon mode)
+            for tmp_path in self.pending.values():
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.pending.clear()
+
+        return changed_files
+
+    def move(self, renames: dict, message: str) -> List[str]:
+        """
+        Move files (`renames`: {old_path: new_path}, relative to the data directory) in one
+        commit (the blobs are not touched).
+
+        :return:    list of the new paths (relative to the repo)
+        """
+
+        if not renames:
+            return []
+
+        proc = self._start_fast_import(message)
+        for old_path, new_path in renames.items():
+            old_path, new_path = self._get_path(old_path), self._get_path(new_path)
+            cmd = f"R {quote_fast_import_path(old_path)} {quote_fast_import_path(new_path)}\n"
+            proc.stdin.write(cmd.encode("utf8"))
+        self._finish_fast_import(proc)
+
+        return sorted(self._get_path(path) for path in renames.values())
+
+    def _start_fast_import(self, message: str) -> subprocess.Popen:
+        """
+        Start a `git fast-import` process and write the header of a new commit (on top of HEAD).
+        The caller writes the file commands to `proc.stdin`.
+        """
+        r = self.repo
+        ref = r.head.reference.path
+        parent = r.head.commit.hexsha
+        committer = r.git.var("GIT_COMMITTER_IDENT")
+        message_bytes = message.encode("utf8")
+
+        cmd = ["git", "fast-import", "--quiet", "--done"]
+        proc = subprocess.Popen(cmd, cwd=r.git_dir, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        stream = proc.stdin
+        stream.write(f"commit {ref}\ncommitter {committer}\n".encode("utf8"))
+        stream.write(b"data %d\n%s\n" % (len(message_bytes), message_bytes))
+        stream.write(f"from {parent}\n".encode("utf8"))
+
+        return proc
+
+    def _finish_fast_import(self, proc: subprocess.Popen):
+        proc.stdin.write(b"done\n")
+        proc.stdin.close()
+        stderr = proc.stderr.read().decode("utf8", errors="replace")
+        if proc.wait() != 0:
+            raise RuntimeError(f"git fast-import failed for {self.repo.git_dir}: {stderr}")
+
+        # a later manual `git commit` must not record the (missing) files as deleted
+        self.repo.git.read_tree("HEAD")
+
+
+STORAGE_BACKENDS = {cls.name: cls for cls in (WorktreeStorage, ObjectStorage)}
+
+
+def chunks(seq: list, size: int):
+    """
+    Split a sequence into consecutive parts of (at most) `size` elements.
+    """
+    for i in range(0, len(seq), size):
+        yield seq[i : i + size]
+
+
+def git_blob_sha1(path: str) -> str:
+    """
+    Calculate the object id which git would assign to the content of the file (as blob).
+    """
+
+    h = hashlib.sha1()
+    h.update(b"blob %d\0" % os.path.getsize(path))
+    with open(path, "rb") as binfile:
+        for chunk in iter(lambda: binfile.read(2**16), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def file_has_content(
+    path: str, size: int, sha256_hexdigest: str, state_entry: dict = None
+) -> bool:
+    """
+    Cheaply decide whether the file at `path` already has the content described by size and hash.
+
+    :param path:                path of the existing file (might not exist)
+    :param size:                size of the new content
+    :param sha256_hexdigest:    hash of the new content
+    :param state_entry:         stored information from the last write (optional). If size and
+                                mtime of the file still match, the stored hash is trusted and the
+                                file is not read at all.
+    """
+
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return False
+
+    if stat_result.st_size != size:
+        return False
+
+    if (
+        state_entry
+        and state_entry.get("size") == stat_result.st_size
+        and state_entry.get("mtime_ns") == stat_result.st_mtime_ns
+        and state_entry.get("sha256")
+    ):
+        return state_entry["sha256"] == sha256_hexdigest
+
+    return file_sha256(path) == sha256_hexdigest
+
+
+def file_sha256(path: str) -> str:
+    """
+    Calculate the sha256-hexdigest of a file (large files are accessed via mmap).
+    """
+
+    h = hashlib.sha256()
+    with open(path, "rb") as binfile:
+        size = os.fstat(binfile.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(binfile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+        else:
+            for chunk in iter(lambda: binfile.read(2**16), b""):
+                h.update(chunk)
+
+    return h.hexdigest()
+
+
+def quote_fast_import_path(path: str) -> str:
+    """
+    Quote a path for `git fast-import` (necessary for paths containing spaces or starting with
+    a double quote).
+    """
+    return '"{}"'.format(path.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
@@ -1,3 +1,5 @@
+import importlib
+
 from colorama import Style, Fore
 
 
@@ -15,3 +17,52 @@ def bred(txt):
 
 def yellow(txt):
     return f"{Fore.YELLOW}{txt}{Style.RESET_ALL}"
+
+
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_interval(value) -> float:
+    """
+    Convert an interval specification to seconds.
+
+    :param value:   number (seconds) or string like "30s", "5m", "2h", "1d", "1w"
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"invalid interval: {value!r}")
+
+    value = value.strip()
+    unit = value[-1].lower()
+    if unit in INTERVAL_UNITS:
+        number = value[:-1]
+    else:
+        unit, number = "s", value
+
+    try:
+        return float(number) * INTERVAL_UNITS[unit]
+    except ValueError:
+        raise ValueError(f"invalid interval: {value!r}")
+
+
+class LazyModule:
+    """
+    Placeholder for a module which is imported on first attribute access. This keeps the startup
+    time of the command line interface short (e.g. for `--help` or `--print-config`).
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        # this is only called for attributes which are not found the usual way
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
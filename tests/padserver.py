@@ -0,0 +1,265 @@
+"""
+Minimal local stand-in for a pad server (used by the tests to avoid network access)
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class PadServer:
+    """
+    Serve the contents of a dict `{padname: bytes}` under `http://127.0.0.1:<port>/p/<padname>`
+
+    Additionally, the pads are available like in etherpad (`/p/<padname>/export/txt` and the api
+    calls `getRevisionsCount`, `getText` and `getRevisionChangeset`) and like in hedgedoc
+    (`/<padname>/download` and `/<padname>/info`).
+    """
+
+    def __init__(self, pads: dict = None, delay: float = 0, error_rate: float = 0, seed=None):
+        """
+        :param pads:        dict like {padname: content_bytes}
+        :param delay:       latency (in seconds) of every response
+        :param error_rate:  probability that a request is answered with `503 Service Unavailable`
+        :param seed:        seed for the random numbers (error responses, `change_pads`)
+        """
+        self.pads = dict(pads or {})
+        self.delay = delay
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        # {padname: [(status_code, headers), ...]}: error responses which are sent (in this order)
+        # before the pad is served normally
+        self.errors = {}
+
+        # {padname: [(status_code, headers), ...]}: like `errors` but for the metadata requests
+        # (probes: `getRevisionsCount` of the api and `/info`)
+        self.probe_errors = {}
+
+        # {padname: revision} reported by the metadata endpoints (default: 0) and the api key
+        self.revisions = {}
+        self.api_key = "test-api-key"
+
+        # {padname: {revision: changeset}} (`getText` always returns the current content)
+        self.changesets = {}
+
+        # statistics which are evaluated by the tests
+        self.request_log = []
+        self.request_times = []
+        self.user_agents = []
+        self.not_modified_count = 0
+        self.random_error_count = 0
+        self.concurrent_requests = 0
+        self.max_concurrent_requests = 0
+
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def url(self, padname: str) -> str:
+        return f"{self.base_url}/p/{padname}"
+
+    def change_pads(self, rate: float) -> list:
+        """
+        Change the content of (approximately) the fraction `rate` of all pads (one line is
+        appended, i.e. the content grows like an edited pad).
+
+        :return:    list of the names of the changed pads
+        """
+        changed = []
+        with self._lock:
+            for padname, content in self.pads.items():
+                if self.random.random() < rate:
+                    self.pads[padname] = content + make_text(self.random, 80)
+                    changed.append(padname)
+        return changed
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _make_handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.request_log.append(self.path)
+                    server.request_times.append(time.monotonic())
+                    server.user_agents.append(self.headers.get("User-Agent"))
+                    server.concurrent_requests += 1
+                    server.max_concurrent_requests = max(
+                        server.max_concurrent_requests, server.concurrent_requests
+                    )
+                try:
+                    if server.delay:
+                        time.sleep(server.delay)
+                    path = urlparse(self.path).path
+                    if "/api/" in path:
+                        self._send_api_response(path.split("/")[-1])
+                    elif path.endswith("/info"):
+                        self._send_note_info(path)
+                    else:
+                        self._send_pad()
+                finally:
+                    with server._lock:
+                        server.concurrent_requests -= 1
+
+            def _send_json(self, data: dict):
+                content = json.dumps(data).encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def _send_api_response(self, method: str):
+                query = parse_qs(urlparse(self.path).query)
+                padname = query["padID"][0]
+                if query.get("apikey") != [server.api_key]:
+                    self._send_json({"code": 4, "message": "no or wrong API Key", "data": None})
+                    return
+                if padname not in server.pads:
+                    self._send_json({"code": 1, "message": "padID does not exist", "data": None})
+                    return
+
+                if method == "getRevisionsCount":
+                    if self._send_injected_error(server.probe_errors, padname):
+                        return
+                    data = {"revisions": server.revisions.get(padname, 0)}
+                elif method == "getText":
+                    data = {"text": server.pads[padname].decode("utf8")}
+                elif method == "getRevisionChangeset":
+                    data = server.changesets[padname][int(query["rev"][0])]
+                else:
+                    self.send_error(404)
+                    return
+                self._send_json({"code": 0, "message": "ok", "data": data})
+
+            def _send_note_info(self, path: str):
+                padname = path.split("/")[-2]
+                if self._send_injected_error(server.probe_errors, padname):
+                    return
+                if padname not in server.pads:
+                    self.send_error(404)
+                    return
+                updatetime = f"2021-01-01T00:00:{server.revisions.get(padname, 0):02d}.000Z"
+                viewcount = len(server.request_log)
+                info = {"title": padname, "updatetime": updatetime, "viewcount": viewcount}
+                self._send_json(info)
+
+            def _send_injected_error(self, errors: dict, padname: str) -> bool:
+                """
+                Send the next error response of the pad (if any) and return True in that case.
+                """
+                with server._lock:
+                    pad_errors = errors.get(padname)
+                    error = pad_errors.pop(0) if pad_errors else None
+                if error is None:
+                    return False
+
+                status_code, headers = error
+                self.send_response(status_code)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return True
+
+            def _send_pad(self):
+                parts = urlparse(self.path).path.rstrip("/").split("/")
+                if parts[-1] == "download":
+                    parts = parts[:-1]
+                elif len(parts) > 2 and parts[-2] == "export":
+                    parts = parts[:-2]
+                padname = parts[-1]
+                with server._lock:
+                    errors = server.errors.get(padname)
+                    error = errors.pop(0) if errors else None
+                if error is None and server.error_rate:
+                    with server._lock:
+                        if server.random.random() < server.error_rate:
+                            server.random_error_count += 1
+                            error = (503, {})
+                if error is not None:
+                    status_code, headers = error
+                    self.send_response(status_code)
+                    for key, value in headers.items():
+                        self.send_header(key, value)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                content = server.pads.get(padname)
+                if content is None:
+                    self.send_error(404)
+                    return
+                etag = f'"{hashlib.sha1(content).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    with server._lock:
+                        server.not_modified_count += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                # keep the test output clean
+                pass
+
+        return Handler
+
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut "
+    "labore et dolore magna aliqua meeting notes agenda todo decision open question pad"
+).split()
+
+
+def make_text(rnd: random.Random, size: int) -> bytes:
+    """
+    Return approximately `size` bytes of random text (random words, lines of ~70 characters).
+    """
+    lines = []
+    length = 0
+    while length < size:
+        line = " ".join(rnd.choice(WORDS) for _ in range(10))
+        lines.append(line)
+        length += len(line) + 1
+    return ("\n".join(lines) + "\n").encode("utf8")
+
+
+def make_synthetic_pads(number: int, size: int, prefix: str = "pad", seed=0) -> dict:
+    """
+    :return:    dict like {padname: content} with `number` pads of approximately `size` bytes
+    """
+    rnd = random.Random(seed)
+    return {f"{prefix}{i:05d}": make_text(rnd, size) for i in range(number)}
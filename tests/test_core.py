@@ -1,17 +1,27 @@
 import sys
 from io import StringIO
 import unittest
+from unittest import mock
 import os
 from contextlib import contextmanager
 import glob
 import subprocess
+import json
 import shutil
 import tempfile
 import time
 import logging
 
+import git
+import yaml
+
 import webtogit as appmod
 from webtogit import Core, APPNAME, DEFAULT_REPO_NAME
+from webtogit.daemon import Daemon
+from webtogit.profiling import Profiler
+from webtogit.util import parse_interval
+
+from .padserver import PadServer
 
 # useful for debugging:
 from ipydex import IPS, activate_ips_on_exception, TracerFactory
@@ -109,6 +119,40 @@ class TestCore(Abstract_WTG_TestCase):
         self.assertEqual(sources[1]["url"], "https://etherpad.wikimedia.org/p/webtogit_testpad2")
         self.assertEqual(sources[1]["name"], "renamed_testpad.md")
 
+    def test_load_sources_include_and_cache(self):
+
+        repo_path = self.c.repo_paths[0]
+        url = "https://pad.example.org/p"
+        write_sources_file(repo_path, [f"{url}/pad1", {"include": "more/sources2.yml"}])
+        os.makedirs(os.path.join(repo_path, "more"))
+        sub_manifest_path = os.path.join(repo_path, "more", "sources2.yml")
+        with open(sub_manifest_path, "w") as txtfile:
+            yaml.safe_dump([f"{url}/pad2", {f"{url}/pad3": {"name": "pad3.md"}}], txtfile)
+
+        sources = self.c.load_webdoc_sources(repo_path)
+        self.assertEqual([s["name"] for s in sources], ["pad1.txt", "pad2.txt", "pad3.md"])
+
+        cache_path = os.path.join(repo_path, appmod.SOURCES_CACHE_FILE_NAME)
+        cache_mtime = os.stat(cache_path).st_mtime_ns
+
+        # unchanged manifests: the cache is used (and not rewritten)
+        self.assertEqual(self.c.load_webdoc_sources(repo_path), sources)
+        self.assertEqual(os.stat(cache_path).st_mtime_ns, cache_mtime)
+
+        # a name collision is detected (instead of silently overwriting a file)
+        with open(sub_manifest_path, "w") as txtfile:
+            yaml.safe_dump([f"{url}/pad2", f"{url}/other/pad1"], txtfile)
+        with self.assertRaises(ValueError) as cm:
+            self.c.load_webdoc_sources(repo_path)
+        self.assertIn("pad1.txt", str(cm.exception))
+
+        # cyclic includes
+        with open(sub_manifest_path, "w") as txtfile:
+            yaml.safe_dump([{"include": f"../{APPNAME}-sources.yml"}], txtfile)
+        with self.assertRaises(ValueError) as cm:
+            self.c.load_webdoc_sources(repo_path)
+        self.assertIn("cyclic", str(cm.exception))
+
     def test_download_and_commit(self):
 
         repo_path = self.c.repo_paths[0]
@@ -138,6 +182,905 @@ class TestCore(Abstract_WTG_TestCase):
         res = self.c.handle_all_repos(print_flag=False)
         # TODO!!: add actual test
 
+    def test_concurrent_download(self):
+
+        pads = {f"pad{i}": f"content of pad {i}\n".encode("utf8") for i in range(8)}
+        repo_path = self.c.repo_paths[0]
+
+        with PadServer(pads, delay=0.1) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+            self.c.jobs = 4
+            self.c.jobs_per_host = 2
+            self.c.download_source_contents(repo_path)
+
+        # the per-host limit must be respected
+        self.assertEqual(server.max_concurrent_requests, 2)
+
+        for name, content in pads.items():
+            pad_path = os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME, f"{name}.txt")
+            with open(pad_path, "rb") as txtfile:
+                self.assertEqual(txtfile.read(), content)
+
+        changed_files = self.c.make_commit(repo_path)
+        self.assertEqual(len(changed_files), 8)
+
+    def test_handle_all_repos_shared_fetch(self):
+
+        pads = {f"pad{i}": f"content of pad {i}\n".encode("utf8") for i in range(6)}
+        self.c.init_archive_repo("second_repo")
+        repo_paths = self.c.find_repos()
+        self.assertEqual(len(repo_paths), 2)
+
+        with PadServer(pads, delay=0.05) as server:
+            write_sources_file(repo_paths[0], [server.url(name) for name in list(pads)[:3]])
+            write_sources_file(repo_paths[1], [server.url(name) for name in list(pads)[3:]])
+            self.c.jobs = 6
+            self.c.jobs_per_host = 3
+            self.c.handle_all_repos(print_flag=False)
+
+        # sources of both repos are fetched together (limited by the per-host setting)
+        self.assertEqual(server.max_concurrent_requests, 3)
+        self.assertEqual(len(server.request_log), 6)
+
+        for repo_path in repo_paths:
+            r = git.Repo(repo_path)
+            self.assertEqual(r.head.commit.message, "track changes to pads\n")
+
+    def test_handle_all_repos_invalid_repo_config(self):
+
+        pads = {f"pad{i}": f"content {i}\n".encode("utf8") for i in range(3)}
+        self.c.init_archive_repo("bad_filters_repo")
+        self.c.init_archive_repo("bad_interval_repo")
+        repo_paths = self.c.find_repos()
+        healthy_path, filters_path, interval_path = [
+            path
+            for name in (DEFAULT_REPO_NAME, "bad_filters_repo", "bad_interval_repo")
+            for path in repo_paths
+            if os.path.basename(path) == name
+        ]
+
+        with PadServer(pads) as server:
+            write_sources_file(healthy_path, [server.url("pad0")])
+            write_sources_file(filters_path, [{server.url("pad1"): {"filters": [{"bogus": 1}]}}])
+            write_sources_file(interval_path, [{server.url("pad2"): {"interval": "soon"}}])
+            write_repo_settings_file(interval_path, {"adaptive_polling": True})
+
+            with self.assertLogs(APPNAME, level="ERROR"):
+                res = self.c.handle_all_repos(print_flag=False)
+
+            # the configuration errors only affect their own repo
+            self.assertEqual(res[healthy_path], ["content/pad0.txt"])
+            self.assertEqual(res.get(filters_path, []), [])
+            self.assertEqual(res.get(interval_path, []), [])
+            self.assertEqual(server.request_log, ["/p/pad0"])
+            self.assertIn("invalid filter", self.c.failed_sources[filters_path]["*"])
+            self.assertIn("invalid interval", self.c.failed_sources[interval_path]["*"])
+
+    def test_handle_all_repos_deduplication(self):
+
+        pads = {f"pad{i}": f"content of pad {i}\nviews: {i}\n".encode("utf8") for i in range(4)}
+        self.c.init_archive_repo("second_repo")
+        repo_paths = self.c.find_repos()
+
+        with PadServer(pads) as server:
+            # pad1 and pad2 are shared; the second repo uses its own name and filter for pad2
+            entries = [server.url(name) for name in ("pad0", "pad1", "pad2")]
+            write_sources_file(repo_paths[0], entries)
+            entries = [
+                # the fragment is not relevant for the request
+                {f"{server.url('pad1')}#latest": {"name": "pad1.txt"}},
+                {server.url("pad2"): {"name": "shared.md", "filters": [{"drop_lines": "^views"}]}},
+                server.url("pad3"),
+            ]
+            write_sources_file(repo_paths[1], entries)
+
+            res = self.c.handle_all_repos(print_flag=False)
+            self.assertEqual(sorted(server.request_log), [f"/p/pad{i}" for i in range(4)])
+            self.assertEqual(len(res[repo_paths[0]]), 3)
+            self.assertEqual(len(res[repo_paths[1]]), 3)
+
+            with open(os.path.join(repo_paths[1], "content", "shared.md")) as txtfile:
+                self.assertEqual(txtfile.read(), "content of pad 2\n")
+            with open(os.path.join(repo_paths[0], "content", "pad2.txt")) as txtfile:
+                self.assertEqual(txtfile.read(), "content of pad 2\nviews: 2\n")
+
+            # the validators of both repos agree -> one conditional request per url
+            del server.request_log[:]
+            self.c.handle_all_repos(print_flag=False)
+            self.assertEqual(len(server.request_log), 4)
+            self.assertEqual(server.not_modified_count, 4)
+
+            # the second repo has no validators -> unconditional request for the shared urls
+            os.remove(os.path.join(repo_paths[1], appmod.STATEFILE_NAME))
+            server.pads["pad1"] = b"new content of pad 1\n"
+            del server.request_log[:]
+            res = self.c.handle_all_repos(print_flag=False)
+            self.assertEqual(len(server.request_log), 4)
+            self.assertEqual(server.not_modified_count, 5)
+            self.assertEqual(res[repo_paths[0]], ["content/pad1.txt"])
+            self.assertEqual(res[repo_paths[1]], ["content/pad1.txt"])
+
+        self.assertEqual(
+            appmod.normalize_url("HTTP://Pad.Example.org:80/p/x#top"), "http://pad.example.org/p/x"
+        )
+
+    def test_conditional_requests(self):
+
+        pads = {"pad1": b"first version\n", "pad2": b"unchanged\n"}
+        repo_path = self.c.repo_paths[0]
+        pad1_path = os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME, "pad1.txt")
+        pad2_path = os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME, "pad2.txt")
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+            self.c.download_source_contents(repo_path)
+            self.assertEqual(server.not_modified_count, 0)
+            self.assertEqual(len(self.c.make_commit(repo_path)), 2)
+
+            state = self.c.load_source_state(repo_path)
+            self.assertTrue(state["pad1.txt"]["etag"])
+
+            mtime2 = os.stat(pad2_path).st_mtime_ns
+            server.pads["pad1"] = b"second version\n"
+            self.c.download_source_contents(repo_path)
+
+            # pad2 was not modified -> server answered with 304 and the file was not rewritten
+            self.assertEqual(server.not_modified_count, 1)
+            self.assertEqual(os.stat(pad2_path).st_mtime_ns, mtime2)
+            with open(pad1_path, "rb") as binfile:
+                self.assertEqual(binfile.read(), b"second version\n")
+            self.assertEqual(self.c.make_commit(repo_path), ["content/pad1.txt"])
+
+            # a missing file must be downloaded again (unconditionally)
+            os.remove(pad2_path)
+            self.c.download_source_contents(repo_path)
+            self.assertEqual(server.not_modified_count, 2)
+            self.assertTrue(os.path.isfile(pad2_path))
+
+    def test_skip_unchanged_files(self):
+
+        pads = {"pad1": b"some content\n", "bigpad": b"x" * (appmod.MMAP_THRESHOLD + 10)}
+        repo_path = self.c.repo_paths[0]
+        pad_path = os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME, "bigpad.txt")
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+            written_files = self.c.download_source_contents(repo_path)
+            self.assertEqual(written_files, ["pad1.txt", "bigpad.txt"])
+            mtime = os.stat(pad_path).st_mtime_ns
+
+            # without the state file no conditional requests are sent and the files are hashed
+            os.remove(os.path.join(repo_path, appmod.STATEFILE_NAME))
+            written_files = self.c.download_source_contents(repo_path)
+            self.assertEqual(server.not_modified_count, 0)
+            self.assertEqual(written_files, [])
+            self.assertEqual(os.stat(pad_path).st_mtime_ns, mtime)
+
+            server.pads["bigpad"] = b"y" * (appmod.MMAP_THRESHOLD + 10)
+            written_files = self.c.download_source_contents(repo_path)
+            self.assertEqual(written_files, ["bigpad.txt"])
+
+    def test_normalization_filters(self):
+
+        pads = {
+            "pad1": b"content 1\nLast edited: 10:00\ntoken=abc123\n",
+            "data": b'{"value": 1, "meta": {"timestamp": 1000, "views": 5}}',
+        }
+        repo_path = self.c.repo_paths[0]
+        data_path = os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME, "data.txt")
+
+        with PadServer(pads) as server:
+            entries = [
+                {server.url("pad1"): {"filters": [{"drop_lines": "^Last edited"}]}},
+                {server.url("data"): {"filters": [{"json_remove_keys": ["views"]}]}},
+            ]
+            write_sources_file(repo_path, entries)
+            # the filters of the repo settings apply to all sources
+            repo_filters = [{"regex": "token=\\w+", "replace": "token=***"}]
+            write_repo_settings_file(repo_path, {"filters": repo_filters})
+
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(len(changed_files), 2)
+            with open(os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME, "pad1.txt")) as txtfile:
+                self.assertEqual(txtfile.read(), "content 1\ntoken=***\n")
+            with open(data_path) as jsonfile:
+                self.assertEqual(json.load(jsonfile), {"value": 1, "meta": {"timestamp": 1000}})
+
+            # only volatile parts changed -> no write and no commit
+            repo = git.Repo(repo_path)
+            head_commit = repo.head.commit
+            mtime = os.stat(data_path).st_mtime_ns
+            server.pads["pad1"] = b"content 1\nLast edited: 11:00\ntoken=def456\n"
+            server.pads["data"] = b'{"value": 1, "meta": {"timestamp": 1000, "views": 6}}'
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, [])
+            self.assertEqual(repo.head.commit, head_commit)
+            self.assertEqual(os.stat(data_path).st_mtime_ns, mtime)
+
+            server.pads["pad1"] = b"content 2\nLast edited: 12:00\ntoken=ghi789\n"
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, ["content/pad1.txt"])
+
+        with self.assertRaises(ValueError):
+            appmod.compile_filters([{"regex": "(", "replace": ""}])
+        with self.assertRaises(ValueError):
+            appmod.compile_filters([{"drop_lines": "a", "regex": "b"}])
+
+    def test_source_adapters(self):
+
+        pads = {"pad1": b"content 1\n", "note1": b"# note 1\n", "pad3": b"content 3\n"}
+        repo_path = self.c.repo_paths[0]
+
+        with PadServer(pads) as server:
+            self.c.config["etherpad_api_keys"] = {server.base_url.split("//")[1]: server.api_key}
+            entries = [
+                # adapters selected by the url
+                f"{server.base_url}/p/pad1/export/txt",
+                {f"{server.base_url}/note1/download": {"name": "note1.md"}},
+                # adapter selected explicitly
+                {server.url("pad3"): {"type": "etherpad"}},
+            ]
+            write_sources_file(repo_path, entries)
+
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(len(changed_files), 3)
+            state = self.c.load_source_state(repo_path)
+            self.assertEqual(state["pad1.txt"]["revision"], "0")
+            self.assertEqual(state["note1.md"]["revision"], "2021-01-01T00:00:00.000Z")
+
+            # only the probes are sent (the changed content of pad1 is not noticed because its
+            # revision did not change)
+            server.pads["pad1"] = b"content 1 (changed)\n"
+            del server.request_log[:]
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, [])
+            self.assertEqual(len(server.request_log), 3)
+            for path in server.request_log:
+                self.assertTrue("getRevisionsCount" in path or path.endswith("/info"), path)
+
+            server.revisions["pad1"] = 1
+            server.revisions["note1"] = 1
+            server.pads["note1"] = b"# note 1 (changed)\n"
+            del server.request_log[:]
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(sorted(changed_files), ["content/note1.md", "content/pad1.txt"])
+            self.assertEqual(len(server.request_log), 5)
+
+            # a new revision without a change of the content (answered by `304 Not Modified`)
+            # is stored as well -> the next run needs the probe only
+            server.revisions["pad3"] = 1
+            del server.request_log[:]
+            self.assertEqual(self.c.handle_repo(repo_path, print_flag=False), [])
+            self.assertEqual(len(server.request_log), 4)
+            self.assertEqual(self.c.load_source_state(repo_path)["pad3.txt"]["revision"], "1")
+            del server.request_log[:]
+            self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(len(server.request_log), 3)
+
+            # temporary errors of a probe are retried (the content is not downloaded)
+            self.c.retry_backoff = 0.01
+            server.probe_errors["note1"] = [(503, {}), (429, {"Retry-After": "0.2"})]
+            del server.request_log[:]
+            self.assertEqual(self.c.handle_repo(repo_path, print_flag=False), [])
+            self.assertEqual(len(server.request_log), 5)
+            self.assertNotIn("/note1/download", server.request_log)
+
+            # after a permanent error of the probe the content is downloaded
+            server.probe_errors["note1"] = [(404, {})]
+            del server.request_log[:]
+            self.assertEqual(self.c.handle_repo(repo_path, print_flag=False), [])
+            self.assertIn("/note1/download", server.request_log)
+
+            # without a valid api key the content is always downloaded (etags are still used)
+            self.c.config["etherpad_api_keys"] = {}
+            del server.request_log[:]
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, [])
+            self.assertIn("/p/pad1/export/txt", server.request_log)
+
+        with self.assertRaises(ValueError):
+            appmod.select_adapter({"url": "https://x.org/a", "type": "unknown"}, self.c.adapters)
+
+    def test_etherpad_changesets(self):
+
+        pads = {"bigpad": b"abc\n"}
+        repo_path = self.c.repo_paths[0]
+        pad_path = os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME, "bigpad.txt")
+
+        def read_pad():
+            with open(pad_path, encoding="utf8") as txtfile:
+                return txtfile.read()
+
+        def get_api_methods():
+            return [path.split("?")[0].split("/")[-1] for path in server.request_log]
+
+        with PadServer(pads) as server:
+            self.c.config["etherpad_api_keys"] = {server.base_url.split("//")[1]: server.api_key}
+            sdict = {"type": "etherpad", "mode": "changesets"}
+            write_sources_file(repo_path, [{server.url("bigpad"): sdict}])
+
+            # the first run needs the whole text
+            self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(read_pad(), "abc\n")
+            self.assertEqual(get_api_methods(), ["getRevisionsCount", "getText"])
+
+            # the pad is not downloaded again: only the changesets are requested
+            server.changesets["bigpad"] = {1: "Z:4>3=3+3$def", 2: "Z:7>0=3-2+2$\U0001f600"}
+            server.revisions["bigpad"] = 2
+            server.pads["bigpad"] = "abc\U0001f600f\n".encode("utf8")
+            del server.request_log[:]
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, ["content/bigpad.txt"])
+            self.assertEqual(read_pad(), "abc\U0001f600f\n")
+            methods = ["getRevisionsCount", "getRevisionChangeset", "getRevisionChangeset"]
+            self.assertEqual(get_api_methods(), methods)
+
+            # changesets which do not match the cached text -> whole text
+            server.changesets["bigpad"][3] = "Z:5>1=9+1$x"
+            server.revisions["bigpad"] = 3
+            server.pads["bigpad"] = "abc\U0001f600fx\n".encode("utf8")
+            del server.request_log[:]
+            self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(read_pad(), "abc\U0001f600fx\n")
+            self.assertEqual(get_api_methods()[-1], "getText")
+
+            # a failed probe: the source is skipped (no export, which has another format)
+            server.probe_errors["bigpad"] = [(404, {})]
+            server.pads["bigpad"] = b"exported text\n"
+            del server.request_log[:]
+            self.assertEqual(self.c.handle_repo(repo_path, print_flag=False), [])
+            self.assertEqual(read_pad(), "abc\U0001f600fx\n")
+            self.assertEqual(get_api_methods(), ["getRevisionsCount"])
+            self.assertEqual(list(self.c.failed_sources[repo_path]), ["bigpad.txt"])
+
+            # too many missing revisions -> whole text
+            self.c.max_changesets = 1
+            server.revisions["bigpad"] = 5
+            server.pads["bigpad"] = b"new text\n"
+            del server.request_log[:]
+            self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(read_pad(), "new text\n")
+            self.assertEqual(get_api_methods(), ["getRevisionsCount", "getText"])
+
+        self.assertEqual(appmod.apply_changeset("abc\ndef\n", "Z:8<2|1=4-2$"), "abc\nf\n")
+        with self.assertRaises(ValueError):
+            appmod.apply_changeset("abc\n", "Z:8>1=1+1$x")
+
+    def test_streaming_download_max_size(self):
+
+        pads = {"pad1": b"a" * 1000, "pad2": b"b" * 100}
+        repo_path = self.c.repo_paths[0]
+        paddir = os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME)
+
+        with PadServer(pads) as server:
+            write_sources_file(
+                repo_path, [server.url("pad1"), {server.url("pad2"): {"max_size": 10}}]
+            )
+            with self.assertRaises(ValueError):
+                self.c.download_source_contents(repo_path)
+
+            # neither partial nor temporary files are left
+            self.assertEqual(os.listdir(paddir), [])
+
+            self.c.max_source_size = 500
+            write_sources_file(repo_path, [server.url("pad1")])
+            with self.assertRaises(ValueError):
+                self.c.download_source_contents(repo_path)
+            self.assertEqual(os.listdir(paddir), [])
+
+            self.c.max_source_size = None
+            self.c.download_source_contents(repo_path)
+            self.assertEqual(os.listdir(paddir), ["pad1.txt"])
+
+    def test_session_reuse(self):
+
+        pads = {f"pad{i}": b"content\n" for i in range(4)}
+        repo_path = self.c.repo_paths[0]
+
+        with PadServer(pads) as server1, PadServer(pads) as server2:
+            entries = [server1.url(name) for name in pads]
+            entries += [{server2.url(name): {"name": f"{name}_2.txt"}} for name in pads]
+            write_sources_file(repo_path, entries)
+            self.c.download_source_contents(repo_path)
+            self.c.download_source_contents(repo_path)
+
+        # one session per host (port) which is reused by all requests
+        self.assertEqual(self.c.session_manager.number_of_sessions, 2)
+        user_agents = set(server1.user_agents + server2.user_agents)
+        self.assertEqual(user_agents, {f"{APPNAME}/{appmod.__version__}"})
+
+    def test_rate_limit_and_retries(self):
+
+        pads = {f"pad{i}": b"content\n" for i in range(5)}
+        repo_path = self.c.repo_paths[0]
+        self.c.retry_backoff = 0.01
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+
+            # 10 requests per second, no bursts
+            self.c.rate_limit = 10
+            self.c.rate_burst = 1
+            self.c.download_source_contents(repo_path)
+            intervals = [t2 - t1 for t1, t2 in zip(server.request_times, server.request_times[1:])]
+            self.assertGreater(min(intervals), 0.08)
+
+            # temporary errors are retried; Retry-After pauses the host
+            self.c.rate_limit = None
+            server.request_times.clear()
+            server.pads["pad0"] = b"new content\n"
+            server.errors["pad0"] = [(503, {}), (429, {"Retry-After": "0.3"})]
+            self.c.download_source_contents(repo_path)
+            self.assertEqual(len(server.request_times), 7)
+            self.assertGreater(server.request_times[-1] - server.request_times[0], 0.3)
+
+            # other errors are not retried
+            server.errors["pad1"] = [(404, {})]
+            with self.assertRaises(appmod.FetchError) as cm:
+                self.c.download_source_contents(repo_path)
+            self.assertEqual(cm.exception.status_code, 404)
+
+            # giving up after max_retries
+            self.c.max_retries = 1
+            server.errors["pad1"] = [(503, {})] * 2
+            with self.assertRaises(ValueError):
+                self.c.download_source_contents(repo_path)
+
+        content_path = os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME, "pad0.txt")
+        with open(content_path, "rb") as binfile:
+            self.assertEqual(binfile.read(), b"new content\n")
+
+    def test_failed_sources_and_resume(self):
+
+        pads = {f"pad{i}": f"content {i}\n".encode("utf8") for i in range(3)}
+        repo_path = self.c.repo_paths[0]
+        journal_path = os.path.join(repo_path, appmod.JOURNAL_FILE_NAME)
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+
+            # a failing source does not prevent the others from being committed
+            server.errors["pad1"] = [(404, {})]
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, ["content/pad0.txt", "content/pad2.txt"])
+            self.assertEqual(list(self.c.failed_sources[repo_path]), ["pad1.txt"])
+            report = self.c.make_report(changed_files, self.c.failed_sources[repo_path])
+            self.assertIn("1 sources failed", report)
+            self.assertFalse(os.path.exists(journal_path))
+
+            # interrupted run (before the commit): the journal remains
+            server.pads["pad0"] = b"new content 0\n"
+            with mock.patch.object(self.c, "make_commit", side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    self.c.handle_repo(repo_path, print_flag=False)
+            self.assertTrue(os.path.exists(journal_path))
+
+            # the next run commits the already written files without downloading them again
+            server.request_log.clear()
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, ["content/pad0.txt", "content/pad1.txt"])
+            self.assertEqual(server.request_log, ["/p/pad2"])
+            self.assertFalse(os.path.exists(journal_path))
+            self.assertEqual(self.c.failed_sources[repo_path], {})
+
+            # a batch with only some of the sources (daemon) keeps the entries of the others
+            server.pads["pad0"] = b"newer content 0\n"
+            server.pads["pad2"] = b"new content 2\n"
+            with mock.patch.object(self.c, "make_commit", side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    self.c.handle_repo(repo_path, print_flag=False)
+
+            sources = self.c.load_webdoc_sources(repo_path)
+            res = self.c.handle_sources({repo_path: sources[2:]}, print_flag=False)
+            self.assertEqual(res[repo_path], ["content/pad2.txt"])
+            self.assertTrue(os.path.exists(journal_path))
+
+            server.request_log.clear()
+            res = self.c.handle_sources({repo_path: sources[:1]}, print_flag=False)
+            self.assertEqual(res[repo_path], ["content/pad0.txt"])
+            self.assertEqual(server.request_log, [])
+            self.assertFalse(os.path.exists(journal_path))
+
+    def test_metrics(self):
+
+        pads = {"pad1": b"content 1\n", "pad2": b"content 2\n"}
+        repo_path = self.c.repo_paths[0]
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+            server.errors["pad2"] = [(404, {})]
+            self.c.handle_repo(repo_path, print_flag=False)
+
+        json_path = os.path.join(TEST_WORK_DIR, "metrics.json")
+        prom_path = os.path.join(TEST_WORK_DIR, "metrics.prom")
+        self.c.export_metrics(json_path, prom_path)
+
+        with open(json_path) as jsonfile:
+            summary = json.load(jsonfile)
+        for phase in ("config_load", "parse_sources", "fetch", "write", "git_add", "git_commit"):
+            self.assertIn(phase, summary["phases"])
+        self.assertEqual(len(summary["requests"]), 2)
+        host = server.base_url.split("//")[1]
+        self.assertEqual(summary["hosts"][host]["bytes"], len(pads["pad1"]))
+        self.assertEqual(summary["hosts"][host]["errors"], 1)
+        self.assertEqual(summary["repos"][repo_path]["failed_sources"], 1)
+
+        with open(prom_path) as txtfile:
+            prom_content = txtfile.read()
+        self.assertIn(f'{APPNAME}_host_requests{{host="{host}"}} 2', prom_content)
+        self.assertIn(f'{APPNAME}_phase_duration_seconds{{phase="fetch"}}', prom_content)
+        sample = f'{APPNAME}_repo_changed_files{{repo="{DEFAULT_REPO_NAME}"}} 1'
+        self.assertIn(sample, prom_content)
+
+    def test_retry_after_parsing(self):
+        self.assertEqual(appmod.parse_retry_after("120"), 120)
+        http_date = "Wed, 21 Oct 2015 07:28:00 GMT"
+        self.assertEqual(appmod.parse_retry_after(http_date, now=1445412470), 10)
+        self.assertIsNone(appmod.parse_retry_after("soon"))
+        self.assertIsNone(appmod.parse_retry_after(None))
+
+    def test_profiling(self):
+
+        pads = {"pad1": b"content 1\n", "pad2": b"content 2\n"}
+        repo_path = self.c.repo_paths[0]
+        profile_dir = os.path.join(TEST_WORK_DIR, "profile")
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+            with Profiler(output_dir=profile_dir, print_flag=False) as profiler:
+                self.c.handle_repo(repo_path, print_flag=False)
+
+        self.assertTrue(os.path.isfile(profiler.pstats_path))
+        self.assertGreater(profiler.peak_memory, 0)
+        for group in ("load_webdoc_sources", "download_source_contents", "make_commit"):
+            self.assertIn(group, profiler.phase_allocations)
+        with open(profiler.report_path) as txtfile:
+            report = txtfile.read()
+        self.assertIn("== download_source_contents (phases: fetch, prepare, write;", report)
+
+        # the profiler must not stay registered
+        self.assertEqual(appmod.RunMetrics.phase_listeners, [])
+
+    def test_parallel_repos(self):
+
+        pads = {f"pad{i}": f"content of pad {i}\n".encode("utf8") for i in range(4)}
+        self.c.init_archive_repo("second_repo")
+        repo_paths = self.c.find_repos()
+
+        # the current working directory must not be relevant
+        os.chdir(tempfile.gettempdir())
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_paths[0], [server.url(name) for name in list(pads)[:2]])
+            write_sources_file(repo_paths[1], [server.url(name) for name in list(pads)[2:]])
+            server.errors["pad3"] = [(404, {})]
+            res = self.c.handle_all_repos(print_flag=False, parallel_repos=2)
+
+        self.assertEqual(os.getcwd(), tempfile.gettempdir())
+        self.assertEqual(sorted(res), sorted(repo_paths))
+        self.assertEqual(len(res[repo_paths[0]]), 2)
+        self.assertEqual(res[repo_paths[1]], ["content/pad2.txt"])
+
+        # the metrics and the failed sources of the worker processes are available
+        self.assertEqual(list(self.c.failed_sources[repo_paths[0]]), [])
+        self.assertEqual(list(self.c.failed_sources[repo_paths[1]]), ["pad3.txt"])
+        summary = self.c.metrics.summary()
+        self.assertEqual(sorted(summary["repos"]), sorted(repo_paths))
+        self.assertEqual(summary["repos"][repo_paths[1]]["failed_sources"], 1)
+        self.assertEqual(len(summary["requests"]), 4)
+        self.assertIn("fetch", summary["phases"])
+
+    def test_targeted_staging(self):
+
+        pads = {"pad1": b"content 1\n", "pad2": b"content 2\n"}
+        repo_path = self.c.repo_paths[0]
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, ["content/pad1.txt", "content/pad2.txt"])
+
+            # a file which is not written by the download step is only noticed by a full rescan
+            other_path = os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME, "other.txt")
+            with open(other_path, "w") as txtfile:
+                txtfile.write("unittest!\n")
+
+            server.pads["pad2"] = b"new content 2\n"
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, ["content/pad2.txt"])
+
+            changed_files = self.c.handle_repo(repo_path, print_flag=False, full_rescan=True)
+            self.assertEqual(changed_files, ["content/other.txt"])
+
+            # the paths are not quoted (like git does for non-ASCII characters and quotes)
+            names = ["Übersicht.txt", '"quoted" pad.txt']
+            entries = [{server.url("pad1"): {"name": names[0]}}]
+            entries.append({server.url("pad2"): {"name": names[1]}})
+            write_sources_file(repo_path, entries)
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(sorted(changed_files), sorted(f"content/{name}" for name in names))
+
+    def test_object_storage_backend(self):
+
+        pads = {"pad1": b"content 1\n", "pad2": b"content 2\n"}
+        repo_path = self.c.repo_paths[0]
+        write_repo_settings_file(repo_path, {"storage_backend": "objects"})
+        r = git.Repo(repo_path)
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, ["content/pad1.txt", "content/pad2.txt"])
+            self.assertEqual(r.git.show("HEAD:content/pad2.txt"), "content 2")
+
+            # the working tree is not used
+            self.assertFalse(os.path.exists(os.path.join(repo_path, appmod.REPO_DATA_DIR_NAME)))
+
+            # without the state file (no conditional requests) the blobs are compared
+            os.remove(os.path.join(repo_path, appmod.STATEFILE_NAME))
+            head_commit = r.head.commit.hexsha
+            self.assertEqual(self.c.handle_repo(repo_path, print_flag=False), [])
+            self.assertEqual(r.head.commit.hexsha, head_commit)
+
+            server.pads["pad1"] = b"new content 1\n"
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, ["content/pad1.txt"])
+            self.assertEqual(r.head.commit.parents[0].hexsha, head_commit)
+            self.assertEqual(r.git.show("HEAD:content/pad1.txt"), "new content 1")
+            self.assertEqual(r.git.show("HEAD:README.md"), r.git.show("HEAD~1:README.md"))
+
+            # special characters in the paths of the fast-import stream are quoted
+            name = '"quoted" pad.txt'
+            write_sources_file(repo_path, [{server.url("pad2"): {"name": name}}])
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, [f"content/{name}"])
+            self.assertEqual(r.git.show(f"HEAD:content/{name}"), "content 2")
+
+            # the index matches HEAD (a manual commit does not delete the archived files)
+            self.assertEqual(r.git.diff("--cached", "--name-only"), "")
+
+            # the pending files of a failed commit are not used by the next run
+            server.pads["pad1"] = b"newer content 1\n"
+            write_sources_file(repo_path, [server.url("pad1")])
+            storage = self.c.get_storage(repo_path)
+            with mock.patch.object(storage, "_finish_fast_import", side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(storage.pending, {})
+            self.assertEqual(os.listdir(storage.get_tmp_dir()), [])
+
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(changed_files, ["content/pad1.txt"])
+            self.assertEqual(r.git.show("HEAD:content/pad1.txt"), "newer content 1")
+
+    def test_ignore_internal_files_of_old_repos(self):
+
+        pads = {"pad1": b"content 1\n"}
+        repo_path = self.c.repo_paths[0]
+        r = git.Repo(repo_path)
+
+        # .gitignore of a repo which was created before the internal files were introduced
+        with open(os.path.join(repo_path, ".gitignore"), "w") as txtfile:
+            txtfile.write("log.txt\n.webtogit\n")
+        r.index.add([".gitignore"])
+        r.index.commit("old .gitignore")
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+            self.c.handle_repo(repo_path, print_flag=False)
+
+            for name in (appmod.STATEFILE_NAME, appmod.JOURNAL_FILE_NAME, "pad.webtogit-tmp"):
+                self.assertTrue(r.ignored(name), name)
+            self.assertEqual(r.untracked_files, ["webtogit-sources.yml"])
+
+            # the patterns are only added once
+            with open(os.path.join(r.git_dir, "info", "exclude")) as txtfile:
+                content = txtfile.read()
+            self.c = Core()
+            self.c.handle_repo(repo_path, print_flag=False)
+            with open(os.path.join(r.git_dir, "info", "exclude")) as txtfile:
+                self.assertEqual(txtfile.read(), content)
+
+    def test_content_layout(self):
+
+        pads = {"pad1": b"content 1\n", "pad2": b"content 2\n"}
+        repo_path = self.c.repo_paths[0]
+        r = git.Repo(repo_path)
+
+        with PadServer(pads) as server:
+            sources = [{"url": server.url(name), "name": f"{name}.txt"} for name in pads]
+            write_sources_file(repo_path, [source["url"] for source in sources])
+            self.c.handle_repo(repo_path, print_flag=False)
+
+            moved_files = self.c.migrate_content_layout(repo_path, "hash", print_flag=False)
+            expected = sorted(
+                f"content/{appmod.get_content_path(source, 'hash')}" for source in sources
+            )
+            self.assertEqual(moved_files, expected)
+            self.assertEqual(self.c.get_content_layout(repo_path), "hash")
+
+            # one commit which consists only of renames
+            status = r.git.show("--name-status", "-M", "--format=", "HEAD").splitlines()
+            self.assertEqual(len(status), 2)
+            self.assertTrue(all(line.startswith("R100") for line in status))
+
+            # new downloads use the new layout; unchanged files are not rewritten
+            server.pads["pad2"] = b"new content 2\n"
+            changed_files = self.c.handle_repo(repo_path, print_flag=False)
+            pad2_path = appmod.get_content_path(sources[1], "hash")
+            self.assertEqual(changed_files, [f"content/{pad2_path}"])
+
+            # the objects backend supports the migration, too
+            write_repo_settings_file(
+                repo_path, {"content_layout": "hash", "storage_backend": "objects"}
+            )
+            c = Core()
+            moved_files = c.migrate_content_layout(repo_path, "host", print_flag=False)
+            expected = ["content/127.0.0.1/pad1.txt", "content/127.0.0.1/pad2.txt"]
+            self.assertEqual(moved_files, expected)
+            self.assertEqual(r.git.show("HEAD:content/127.0.0.1/pad2.txt"), "new content 2")
+
+    def test_maintenance(self):
+
+        pads = {"pad1": b"content 1\n", "pad2": b"content 2\n"}
+        repo_path = self.c.repo_paths[0]
+        write_repo_settings_file(repo_path, {"maintenance_loose_objects": 3})
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [server.url(name) for name in pads])
+            self.c.handle_repo(repo_path, print_flag=False)
+
+        # the loose objects were packed automatically
+        stats = self.c.get_object_stats(repo_path)
+        self.assertEqual(stats["count"], 0)
+        self.assertEqual(stats["packs"], 1)
+
+        res = self.c.maintain_all_repos(print_flag=False)
+        self.assertEqual(res[repo_path]["action"], "gc")
+        self.assertEqual(res[repo_path]["after"]["packs"], 1)
+
+    def test_daemon_scheduling(self):
+
+        pads = {"hotpad": b"hot\n", "coldpad": b"cold\n"}
+        repo_path = self.c.repo_paths[0]
+
+        with PadServer(pads) as server:
+            entries = [{server.url("hotpad"): {"interval": "5m"}}, server.url("coldpad")]
+            write_sources_file(repo_path, entries)
+
+            daemon = Daemon(self.c, print_flag=False)
+            daemon.batch_window = 0
+
+            res = daemon.run_once(now=0)
+            self.assertEqual(len(res[repo_path]), 2)
+            self.assertEqual(len(server.request_log), 2)
+
+            # nothing is due
+            self.assertEqual(daemon.run_once(now=100), {})
+            self.assertEqual(daemon.next_due_time, 300)
+
+            server.pads["hotpad"] = b"hot (changed)\n"
+            res = daemon.run_once(now=300)
+            self.assertEqual(res[repo_path], ["content/hotpad.txt"])
+            self.assertEqual(server.request_log[-1], "/p/hotpad")
+            self.assertEqual(len(server.request_log), 3)
+
+            # the cold pad is due after one day (default interval)
+            daemon.run_once(now=86400)
+            self.assertEqual(sorted(server.request_log[3:]), ["/p/coldpad", "/p/hotpad"])
+
+    def test_daemon_invalid_sources_file(self):
+
+        pads = {"pad1": b"content 1\n"}
+        repo_path = self.c.repo_paths[0]
+
+        with PadServer(pads) as server:
+            write_sources_file(repo_path, [{server.url("pad1"): {"interval": "5m"}}])
+
+            daemon = Daemon(self.c, print_flag=False)
+            daemon.batch_window = 0
+            daemon.rescan_interval = 0
+
+            res = daemon.run_once(now=0)
+            self.assertEqual(res[repo_path], ["content/pad1.txt"])
+
+            # a broken sources file (e.g. while it is being edited) does not stop the daemon
+            with open(os.path.join(repo_path, f"{APPNAME}-sources.yml"), "w") as txtfile:
+                txtfile.write("- [unclosed\n")
+
+            server.pads["pad1"] = b"new content 1\n"
+            with self.assertLogs(APPNAME, level="ERROR") as logs:
+                res = daemon.run_once(now=300)
+            self.assertIn("could not load the sources", logs.output[0])
+            self.assertEqual(res[repo_path], ["content/pad1.txt"])
+            self.assertEqual(list(daemon.sources[repo_path]), ["pad1.txt"])
+
+    def test_adaptive_polling(self):
+
+        pads = {"pad1": b"content 1\n", "pad2": b"content 2\n", "pad3": b"content 3\n"}
+        repo_path = self.c.repo_paths[0]
+        settings = {"adaptive_polling": True, "min_interval": "1h", "max_interval": "4d"}
+        write_repo_settings_file(repo_path, settings)
+
+        with PadServer(pads) as server:
+            # non-ASCII characters in the name (git quotes such paths in its default output)
+            entries = [server.url("pad1"), server.url("pad2")]
+            entries.append({server.url("pad3"): {"name": "Übersicht.txt"}})
+            write_sources_file(repo_path, entries)
+            self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(len(server.request_log), 3)
+
+            # new files count as change -> interval is tightened
+            state = self.c.load_source_state(repo_path)
+            self.assertEqual(state["pad1.txt"]["poll_interval"], 43200)
+            self.assertEqual(state["pad1.txt"]["change_count"], 1)
+
+            # no source is due
+            self.assertEqual(self.c.handle_repo(repo_path, print_flag=False), [])
+            self.assertEqual(len(server.request_log), 3)
+
+            # pretend that the last download of both sources was one day ago
+            for entry in state.values():
+                entry["last_poll"] -= 86400
+            self.c.save_source_state(repo_path, state)
+
+            server.pads["pad2"] = b"new content 2\n"
+            server.pads["pad3"] = b"new content 3\n"
+            self.c.handle_repo(repo_path, print_flag=False)
+            self.assertEqual(len(server.request_log), 6)
+
+            state = self.c.load_source_state(repo_path)
+            self.assertEqual(state["pad1.txt"]["poll_interval"], 86400)
+            self.assertEqual(state["pad2.txt"]["poll_interval"], 21600)
+            self.assertEqual(state["Übersicht.txt"]["poll_interval"], 21600)
+            self.assertEqual(state["Übersicht.txt"]["change_count"], 2)
+            self.assertEqual(state["pad2.txt"]["poll_count"], 2)
+            self.assertEqual(self.c.get_poll_interval(repo_path, {"name": "pad2.txt"}), 21600)
+
+    def test_repo_registry(self):
+
+        repo_path = self.c.repo_paths[0]
+        self.assertTrue(os.path.isfile(self.c.registry_path))
+
+        # a valid registry is used without opening any repo
+        with mock.patch.object(appmod.core, "git") as git_mock:
+            c = Core()
+            self.assertEqual(c.repo_paths, (repo_path,))
+            git_mock.Repo.assert_not_called()
+
+        # a repo which was created by other means changes the mtime of the data dir -> rescan
+        second_repo_path = os.path.join(self.c.datadir_path, "second_repo")
+        git.Repo.init(second_repo_path)
+        open(os.path.join(second_repo_path, appmod.CHECKFILE_NAME), "w").close()
+        self.assertEqual(Core().repo_paths, (repo_path, second_repo_path))
+
+        # removing the check file invalidates the registry, too
+        os.remove(os.path.join(second_repo_path, appmod.CHECKFILE_NAME))
+        self.assertEqual(Core().repo_paths, (repo_path,))
+
+    def test_parse_interval(self):
+        self.assertEqual(parse_interval(30), 30)
+        self.assertEqual(parse_interval("30"), 30)
+        self.assertEqual(parse_interval("5m"), 300)
+        self.assertEqual(parse_interval("1.5h"), 5400)
+        self.assertEqual(parse_interval("1d"), 86400)
+        with self.assertRaises(ValueError):
+            parse_interval("5x")
+
+
+def write_sources_file(repo_path: str, entries: list):
+    """
+    Replace the sources file of the repo (e.g. with urls pointing to a local `PadServer`).
+    """
+
+    with open(os.path.join(repo_path, f"{APPNAME}-sources.yml"), "w") as txtfile:
+        yaml.safe_dump(entries, txtfile)
+
+
+def write_repo_settings_file(repo_path: str, settings: dict):
+    with open(os.path.join(repo_path, appmod.REPO_SETTINGS_FILE_NAME), "w") as txtfile:
+        yaml.safe_dump(settings, txtfile)
+
 
 def run_command(cmd, env: dict, print_full_cmd=False) -> subprocess.CompletedProcess:
     """
@@ -183,15 +1126,28 @@ class TestCommandLine(Abstract_WTG_TestCase):
     def test_run_main_regular(self):
 
         self._bootstrap_app()
+        repo_path = os.path.join(TEST_WORK_DIR, DEFAULT_REPO_NAME)
 
-        res = run_command([APPNAME], self.environ)
-        self.assertEqual(res.returncode, 0)
+        with PadServer({"pad1": b"content 1\n"}) as server:
+            write_sources_file(repo_path, [server.url("pad1")])
 
-        res = run_command([APPNAME, DEFAULT_REPO_NAME], self.environ)
-        self.assertEqual(res.returncode, 0)
+            res = run_command([APPNAME], self.environ)
+            self.assertEqual(res.returncode, 0)
 
-        res = run_command([APPNAME, "--update-all-repos"], self.environ)
-        self.assertEqual(res.returncode, 0)
+            res = run_command([APPNAME, DEFAULT_REPO_NAME], self.environ)
+            self.assertEqual(res.returncode, 0)
+
+            res = run_command([APPNAME, "--update-all-repos"], self.environ)
+            self.assertEqual(res.returncode, 0)
+
+            # failed sources are reported by the exit code (the other sources are committed)
+            write_sources_file(repo_path, [server.url("pad1"), server.url("missing_pad")])
+
+            res = run_command([APPNAME], self.environ)
+            self.assertEqual(res.returncode, 1)
+
+            res = run_command([APPNAME, "--update-all-repos"], self.environ)
+            self.assertEqual(res.returncode, 1)
 
     def test_run_main_nonedefault_reponame(self):
 
@@ -215,11 +1171,15 @@ class TestCommandLine(Abstract_WTG_TestCase):
         self.assertEqual(res.returncode, 0)
         self.assertIn("Nothing done", res.stdout)
 
-        res = run_command([APPNAME, "nonedefault_reponame"], self.environ)
-        self.assertEqual(res.returncode, 0)
+        with PadServer({"pad1": b"content 1\n"}) as server:
+            for reponame in (DEFAULT_REPO_NAME, "nonedefault_reponame"):
+                write_sources_file(os.path.join(TEST_WORK_DIR, reponame), [server.url("pad1")])
 
-        res = run_command([APPNAME, "--update-all-repos"], self.environ)
-        self.assertEqual(res.returncode, 0)
+            res = run_command([APPNAME, "nonedefault_reponame"], self.environ)
+            self.assertEqual(res.returncode, 0)
+
+            res = run_command([APPNAME, "--update-all-repos"], self.environ)
+            self.assertEqual(res.returncode, 0)
 
         self.assertIn(DEFAULT_REPO_NAME, res.stdout)
         self.assertIn("nonedefault_reponame", res.stdout)
@@ -250,6 +1210,43 @@ class TestCommandLine(Abstract_WTG_TestCase):
         self.assertIn("already bootstrapped", res.stdout)
 
 
+class TestStartup(unittest.TestCase):
+
+    # these modules must not be imported at startup (this is the actual guard)
+    HEAVY_MODULES = ("git", "requests", "yaml", "ipydex", "IPython", "asyncio")
+
+    # generous upper bound for the import time of the cli module (in seconds, best of several
+    # runs): only a gross regression should fail on a loaded machine
+    IMPORT_TIME_THRESHOLD = 1.0
+    IMPORT_TIME_RUNS = 5
+
+    @staticmethod
+    def get_import_times() -> dict:
+        """
+        :return:    dict like {module: cumulative import time in seconds} of one fresh process
+        """
+        cmd = [sys.executable, "-X", "importtime", "-c", f"import {APPNAME}.cli"]
+        res = subprocess.run(cmd, capture_output=True, check=True)
+
+        # lines look like: "import time:   self [us] | cumulative | imported package"
+        cumulative = {}
+        for line in res.stderr.decode("utf8").splitlines():
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            _, cumulative_us, module = line.split("|")
+            cumulative[module.strip()] = int(cumulative_us) * 1e-6
+        return cumulative
+
+    def test_import_time(self):
+        import_times = [self.get_import_times() for _ in range(self.IMPORT_TIME_RUNS)]
+
+        for module in self.HEAVY_MODULES:
+            self.assertNotIn(module, import_times[0])
+
+        best_time = min(times[f"{APPNAME}.cli"] for times in import_times)
+        self.assertLess(best_time, self.IMPORT_TIME_THRESHOLD)
+
+
 class TestBootstrap(Abstract_WTG_TestCase):
     def setUp(self):
         self.environ = {f"{APPNAME}_DATADIR_PATH": TEST_WORK_DIR}